@@ -1,17 +1,25 @@
+import logging
 import re
-from crewai import Agent, Task
-from typing import List, Dict
-from model import GeminiLLM, summarize_text, mcq_generate, custom_data_retriever
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator
+from model import (
+    get_llm, mcq_generate, custom_data_retriever, batch_data_retriever, LLM_ERROR_RESPONSE,
+    GEMINI_MODEL, SUMMARY_PROMPT_VERSION, MCQ_PROMPT_VERSION,
+)
 from config import Config
-from vector_db import get_content_and_title
-from utils.embeddings import generate_embeddings
+from vector_db import get_content_and_title, get_content_hash
+from cache import cached_result, get_cached_result, store_cached_result
+from llm_client import get_llm_client
+from semantic_cache import get_semantic_cache
+from context_packer import pack_context, format_context
+from instrumentation import span
+from summarizer import summarize_long_text, final_summary_prompt, condensed_content
+from utils.embeddings import generate_embeddings, generate_embeddings_batch
 from langchain_core.documents import Document
-from langchain.chains import RetrievalQA
-from langchain_core.retrievers import BaseRetriever
 
+logger = logging.getLogger(__name__)
 
-# Initialize LLM
-llm = GeminiLLM(api_key=Config.GEMINI_API_KEY)
 
 def content_retrieval_task(title: str) -> Dict:
     """
@@ -20,56 +28,88 @@ def content_retrieval_task(title: str) -> Dict:
     result = get_content_and_title(title)
     return result if result else {}
 
-def summarization_task(title: str) -> str:
+def summarization_task(title: str, force_refresh: bool = False) -> str:
     """
-    Generates a summary for the content of a given title.
+    Generates a summary for the content of a given title, using map-reduce
+    summarization for long papers.
+    Summaries are cached per paper content; force_refresh regenerates it.
     """
-    result = get_content_and_title(title)
-    if not result:
+    content_hash = get_content_hash(title)
+    if not content_hash:
         return ""
-    return summarize_text(result["content"])
 
-def mcq_generation_task(title: str) -> list:
+    def generate():
+        result = get_content_and_title(title)
+        return summarize_long_text(result["content"]) if result else ""
+
+    return cached_result(content_hash, "summary", SUMMARY_PROMPT_VERSION, GEMINI_MODEL, generate, force_refresh)
+
+def mcq_generation_task(title: str, force_refresh: bool = False) -> list:
     """
-    Generates MCQs based on the content of a given title.
+    Generates MCQs based on the content of a given title; long papers are
+    condensed to their (cached) section summaries first.
+    MCQs are cached per paper content; force_refresh regenerates them.
     """
-    result = get_content_and_title(title)
-    if not result:
+    content_hash = get_content_hash(title)
+    if not content_hash:
         return []
-    return mcq_generate(result["content"])
+
+    def generate():
+        result = get_content_and_title(title)
+        if not result:
+            return []
+        try:
+            content = condensed_content(result["content"])
+        except Exception as e:
+            # Nothing is cached for an empty result, so the next request retries
+            logger.error("Failed to summarize sections for MCQs: %s", e)
+            return []
+        return mcq_generate(content)
+
+    return cached_result(content_hash, "mcq", MCQ_PROMPT_VERSION, GEMINI_MODEL, generate, force_refresh)
     
 
-def query_answering_task(query: str) -> str:
+def clean_response(response: str) -> str:
     """
-    Answers a query by searching across all papers in the database using RAG.
-    If no relevant content is found, falls back to a direct Gemini LLM response.
+    Remove Markdown emphasis from an LLM response.
     """
-    if not query:
-        return "Query is required"
-    
-    query_embedding = generate_embeddings(query)
-    documents = custom_data_retriever(query_embedding, k=5)
-    
-    # Check if we have relevant and sufficient documents
-    has_relevant_info = False
-    total_content_length = 0
-    content_texts = []
-    paper_title = "Unknown"
-    
-    if documents:
-        # Check both keyword relevance AND content sufficiency
-        query_keywords = query.lower().split()
-        for doc in documents:
-            content = doc.page_content.lower()
-            content_texts.append(doc.page_content)
-            total_content_length += len(content)
-            
-            # Check if document contains keywords from query
-            if any(keyword in content for keyword in query_keywords):
-                has_relevant_info = True
-                paper_title = doc.metadata.get("title", "Unknown")
-                print(f"[DEBUG] Relevant content found in paper: {paper_title}")
-                break  # We only need the title of the top relevant document
+    return re.sub(r'\*\*|\*', '', response).strip()
+
+def clean_response_stream(deltas: Iterator[str]) -> Iterator[str]:
+    """
+    Incremental clean_response: strips Markdown emphasis from each streamed
+    delta, drops leading whitespace and holds back trailing whitespace so the
+    concatenated output equals clean_response of the full text.
+    """
+    started = False
+    pending = ""
+    for delta in deltas:
+        text = pending + delta.replace("*", "")
+        if not started:
+            text = text.lstrip()
+            if not text:
+                continue
+            started = True
+        stripped = text.rstrip()
+        pending = text[len(stripped):]
+        if stripped:
+            yield stripped
+
+def build_query_prompt(query: str, documents: List[Document]) -> str:
+    """
+    Builds the RAG prompt for a query from the documents retrieved across all papers.
+    The documents are packed into cited passages within CONTEXT_TOKEN_BUDGET tokens.
+    If no relevant content is found, the prompt asks for a general knowledge response.
+    """
+    # Relevance is decided by the hybrid retriever; passages are ranked by fused score
+    with span("context_pack"):
+        passages = pack_context(documents)
+    has_relevant_info = bool(passages)
+    context_text = format_context(passages)
+    total_content_length = sum(len(passage["text"]) for passage in passages)
+    paper_title = passages[0]["title"] if passages else "Unknown"
+    if has_relevant_info:
+        logger.debug("Relevant content found in paper: %s (%s passages)", paper_title, len(passages))
     
     # Define minimum content threshold
     MIN_CONTENT_LENGTH = 50
@@ -98,20 +138,17 @@ def query_answering_task(query: str) -> str:
     
     # CASE 1: If we have BOTH relevant AND sufficient content
     if has_relevant_info and has_sufficient_content:
-        context_text = "\n\n".join(content_texts)
-        context_instruction = f"Here are relevant sections from the paper '{paper_title}' to help you answer:\n\n{context_text}"
-        complete_prompt = static_prompt_template.format(
+        context_instruction = (
+            "Here are relevant sections from the stored papers, each headed by its source "
+            f"(title and page), to help you answer:\n\n{context_text}"
+        )
+        return static_prompt_template.format(
             query=query,
             context_instruction=context_instruction
         )
-        response = llm._call(complete_prompt)
-        # Clean the response to remove Markdown formatting
-        clean_response = re.sub(r'\*\*|\*', '', response).strip()
-        return clean_response
     
     # CASE 2: If we have relevance but INSUFFICIENT content
     elif has_relevant_info and not has_sufficient_content:
-        context_text = "\n\n".join(content_texts)
         context_instruction = f"""
         The paper '{paper_title}' mentions concepts related to your query, but I only have limited excerpts:
         
@@ -119,55 +156,203 @@ def query_answering_task(query: str) -> str:
         
         This limited information suggests the topic is addressed in the paper, but I don't have enough context to provide a complete answer. I'll provide what insights I can based on the available content and general knowledge.
         """
-        complete_prompt = static_prompt_template.format(
+        return static_prompt_template.format(
             query=query,
             context_instruction=context_instruction
         )
-        response = llm._call(complete_prompt)
-        # Clean the response to remove Markdown formatting
-        clean_response = re.sub(r'\*\*|\*', '', response).strip()
-        return clean_response
     
     # CASE 3: No relevant content found
     else:
-        print("[DEBUG] No relevant content found in any paper. Falling back to direct Gemini response.")
+        logger.debug("No relevant content found in any paper. Falling back to direct Gemini response.")
         context_instruction = """
         Based on my analysis, I couldn't find specific information in the stored papers addressing this query. 
         I'll provide a general knowledge response.
         """
-        complete_prompt = static_prompt_template.format(
+        return static_prompt_template.format(
             query=query,
             context_instruction=context_instruction
         )
-        response = llm._call(complete_prompt)
-        # Clean the response to remove Markdown formatting
-        clean_response = re.sub(r'\*\*|\*', '', response).strip()
-        return clean_response
-
-# Define Agents with their respective tasks
-summarizer_agent = Agent(
-    role="Summarizer",
-    goal="Generate concise summaries of research papers",
-    backstory="An expert in distilling complex academic texts into clear summaries.",
-    llm=llm,
-    verbose=True,
-    allow_delegation=False
-)
 
-mcq_generator_agent = Agent(
-    role="MCQ Generator",
-    goal="Create accurate multiple-choice questions based on paper content",
-    backstory="A skilled educator crafting questions to test understanding.",
-    llm=llm,
-    verbose=True,
-    allow_delegation=False
-)
+def query_answering_task(query: str, titles=None) -> str:
+    """
+    Answers a query by searching across all papers in the database (or only the
+    given titles) using RAG. If no relevant content is found, falls back to a
+    direct Gemini LLM response. Answers to semantically equivalent earlier
+    unfiltered queries are served from the semantic cache.
+    """
+    if not query:
+        return "Query is required"
+
+    query_embedding = generate_embeddings(query)
+    # Answers restricted to some papers are not interchangeable with unfiltered ones
+    semantic_cache = get_semantic_cache() if Config.SEMANTIC_CACHE_ENABLED and not titles else None
+    if semantic_cache:
+        cached = semantic_cache.lookup(query_embedding)
+        if cached is not None:
+            return cached
+
+    documents = custom_data_retriever(query_embedding, query, k=5, titles=titles)
+    response = get_llm()._call(build_query_prompt(query, documents))
+    # Clean the response to remove Markdown formatting
+    answer = clean_response(response)
+    if semantic_cache and answer and response != LLM_ERROR_RESPONSE:
+        semantic_cache.store(query, query_embedding, documents, answer)
+    return answer
+
+def answer_queries_batch(queries: List[str], titles=None) -> List[Dict]:
+    """
+    Batch variant of query_answering_task. All queries are embedded in one
+    encode call, checked against the semantic cache together and searched in
+    one database round trip; Gemini is then called for the semantic cache
+    misses, CHATBOT_BATCH_CONCURRENCY at a time.
+    Returns one {"query", "response", "error"} dict per query, in order; a
+    failed query has a None response and the error message.
+    """
+    results = [{"query": query, "response": None, "error": None} for query in queries]
+    pending = []
+    for i, query in enumerate(queries):
+        if isinstance(query, str) and query.strip():
+            pending.append(i)
+        else:
+            results[i]["error"] = "Query is required"
+    if not pending:
+        return results
+
+    query_embeddings = generate_embeddings_batch([queries[i] for i in pending])
+    embeddings = dict(zip(pending, query_embeddings))
+
+    # Answers restricted to some papers are not interchangeable with unfiltered ones
+    semantic_cache = get_semantic_cache() if Config.SEMANTIC_CACHE_ENABLED and not titles else None
+    if semantic_cache:
+        misses = []
+        for i, cached in zip(pending, semantic_cache.lookup_batch([embeddings[i] for i in pending])):
+            if cached is not None:
+                results[i]["response"] = cached
+            else:
+                misses.append(i)
+        pending = misses
+    if not pending:
+        return results
+
+    try:
+        all_documents = batch_data_retriever(
+            [embeddings[i] for i in pending], [queries[i] for i in pending], k=5, titles=titles
+        )
+    except Exception as e:
+        logger.error("Batch retrieval error: %s", e)
+        for i in pending:
+            results[i]["error"] = f"Retrieval failed: {e}"
+        return results
+    documents = dict(zip(pending, all_documents))
+
+    def answer(i):
+        query = queries[i]
+        try:
+            response = clean_response(get_llm_client().generate(build_query_prompt(query, documents[i])))
+        except Exception as e:
+            logger.error("Batch query %s failed: %s", i, e)
+            results[i]["error"] = str(e)
+            return
+        results[i]["response"] = response
+        if semantic_cache and response:
+            semantic_cache.store(query, embeddings[i], documents[i], response)
+
+    workers = max(1, min(Config.CHATBOT_BATCH_CONCURRENCY, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chatbot-batch") as executor:
+        list(executor.map(answer, pending))
+    return results
+
+def stream_query_answer(query: str, titles=None) -> Iterator[str]:
+    """
+    Streaming variant of query_answering_task: yields cleaned answer text as
+    Gemini generates it. A semantic cache hit is yielded in one piece.
+    """
+    query_embedding = generate_embeddings(query)
+    # Answers restricted to some papers are not interchangeable with unfiltered ones
+    semantic_cache = get_semantic_cache() if Config.SEMANTIC_CACHE_ENABLED and not titles else None
+    if semantic_cache:
+        cached = semantic_cache.lookup(query_embedding)
+        if cached is not None:
+            yield cached
+            return
+
+    documents = custom_data_retriever(query_embedding, query, k=5, titles=titles)
+    parts = []
+    for delta in clean_response_stream(get_llm_client().stream_generate(build_query_prompt(query, documents))):
+        parts.append(delta)
+        yield delta
+
+    answer = "".join(parts)
+    if semantic_cache and answer:
+        semantic_cache.store(query, query_embedding, documents, answer)
+
+def stream_summary(title: str, force_refresh: bool = False) -> Iterator[str]:
+    """
+    Streaming variant of summarization_task. A cached summary is yielded in
+    one piece; otherwise the summary is streamed from Gemini and cached once complete.
+    """
+    content_hash = get_content_hash(title)
+    if not content_hash:
+        return
+
+    if not force_refresh:
+        cached = get_cached_result(content_hash, "summary", SUMMARY_PROMPT_VERSION, GEMINI_MODEL)
+        if cached:
+            yield cached
+            return
+
+    result = get_content_and_title(title)
+    if not result:
+        return
+
+    parts = []
+    for delta in get_llm_client().stream_generate(final_summary_prompt(result["content"])):
+        parts.append(delta)
+        yield delta
+
+    summary = "".join(parts).strip()
+    if summary:
+        store_cached_result(content_hash, "summary", SUMMARY_PROMPT_VERSION, GEMINI_MODEL, summary)
+
+_agents = None
+_agents_lock = threading.Lock()
+
+def get_agents() -> Dict:
+    """
+    Return the crewAI agents by name, building them on first use: crewai is a
+    heavy import that no endpoint needs at startup.
+    """
+    global _agents
+    if _agents is None:
+        with _agents_lock:
+            if _agents is None:
+                from crewai import Agent
 
-chatbot_agent = Agent(
-    role="Research Assistant",
-    goal="Answer user queries accurately using paper content",
-    backstory="A knowledgeable assistant with access to research papers.",
-    llm=llm,
-    verbose=True,
-    allow_delegation=False
-)
\ No newline at end of file
+                llm = get_llm()
+                _agents = {
+                    "summarizer": Agent(
+                        role="Summarizer",
+                        goal="Generate concise summaries of research papers",
+                        backstory="An expert in distilling complex academic texts into clear summaries.",
+                        llm=llm,
+                        verbose=True,
+                        allow_delegation=False
+                    ),
+                    "mcq_generator": Agent(
+                        role="MCQ Generator",
+                        goal="Create accurate multiple-choice questions based on paper content",
+                        backstory="A skilled educator crafting questions to test understanding.",
+                        llm=llm,
+                        verbose=True,
+                        allow_delegation=False
+                    ),
+                    "chatbot": Agent(
+                        role="Research Assistant",
+                        goal="Answer user queries accurately using paper content",
+                        backstory="A knowledgeable assistant with access to research papers.",
+                        llm=llm,
+                        verbose=True,
+                        allow_delegation=False
+                    ),
+                }
+    return _agents
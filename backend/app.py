@@ -1,23 +1,96 @@
+import json
 import logging
-from typing import List
+import os
+import tempfile
+import time
+import unicodedata
+from urllib.parse import quote
 from flask_cors import CORS
-from flask import Flask, request, jsonify
-from utils.pdf_parser import extract_text_from_pdf
-from vector_db import db_connection, store_to_pgvector, get_content_and_title, debug_pgvector_table
-from model import summarize_text, mcq_generate, embeddings, custom_data_retriever, llm
-from utils.embeddings import generate_embeddings
-from langchain_core.documents import Document
-from langchain_core.retrievers import BaseRetriever
-from langchain.chains import RetrievalQA
-import torchvision
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from config import Config
+from instrumentation import configure_logging, observe_first_chunk, render_metrics, REQUEST_SECONDS
+from vector_db import fetch_titles as fetch_paper_titles, get_pdf_and_title, iter_pdf_chunks
+from ingest import ingest_pdf_path
+from jobs import get_job_queue, INGEST_STAGES
+from db import get_connection, pool_stats
+from llm_client import get_llm_client
+from schema import ensure_schema
+from semantic_cache import get_semantic_cache
+from utils.embeddings import embedding_service, get_embedding_model
 from crew import run_crew
 
-from agents import summarization_task 
-torchvision.disable_beta_transforms_warning()
+from agents import summarization_task, stream_query_answer, stream_summary, answer_queries_batch
+
+configure_logging()
 
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """
+    Observe the request duration. This hook runs before a streamed body
+    (SSE answers, PDF downloads) produces anything, so those responses are
+    observed when their first chunk is ready instead.
+    """
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    histogram = REQUEST_SECONDS.labels(
+        request.url_rule.rule if request.url_rule else "unmatched",
+        request.method,
+        str(response.status_code),
+    )
+
+    def observe():
+        histogram.observe(time.perf_counter() - started)
+
+    if response.is_streamed:
+        response.response = observe_first_chunk(response.response, observe)
+    else:
+        observe()
+    return response
+
+def warm_up():
+    """
+    Load the embedding model and open the database pool and LLM client ahead of
+    the first request. Everything is otherwise initialized lazily on first use.
+    """
+    get_embedding_model().encode(["warm up"])
+    # Fails fast with SchemaError when schema.py migrate has not been run
+    with get_connection() as conn:
+        ensure_schema(conn)
+    get_llm_client()
+
+def wants_stream(data):
+    return bool(data.get("stream")) or request.accept_mimetypes.best == "text/event-stream"
+
+def sse_response(deltas, final_key, **fields):
+    """
+    Send text deltas as Server-Sent Events: one "token" event per delta, then
+    a "done" event carrying the full text under final_key, or an "error" event.
+    """
+    def events():
+        parts = []
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield f"event: token\ndata: {json.dumps({'text': delta})}\n\n"
+            yield f"event: done\ndata: {json.dumps({**fields, final_key: ''.join(parts)})}\n\n"
+        except Exception as e:
+            logging.error(f"Error while streaming {final_key}: {e}", exc_info=True)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route('/upload', methods=['POST'])
 def upload_paper():
     try:
@@ -27,30 +100,44 @@ def upload_paper():
         if not title or not file:
             return jsonify({"error": "Title and file are required"}), 400
 
-        text_content = extract_text_from_pdf(file)
-        if not text_content:
-            return jsonify({"error": "Failed to extract text from PDF"}), 500
-
-        embeddings = generate_embeddings(text_content)
+        # Spool the upload to disk so the request can return before processing
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spooled:
+            file.save(spooled)
 
-        file.seek(0)
-        file_binary = file.read()
+        try:
+            job_id = get_job_queue().submit(ingest_pdf_path, title, spooled.name, stages=INGEST_STAGES)
+        except Exception:
+            # The job would have removed the file; without one nothing will
+            os.unlink(spooled.name)
+            raise
 
-        store_to_pgvector(title, text_content, embeddings, file_binary)
-
-        return jsonify({"message": "PDF uploaded and stored successfully"}), 200
+        return jsonify({
+            "message": "PDF accepted for processing",
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}",
+        }), 202
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
 @app.route('/summary', methods=['POST'])
 def summarize_pdf():
     try:
         title = request.json.get("title")
         if not title:
             return jsonify({"error": "Title is required"}), 400
+
+        if wants_stream(request.json):
+            return sse_response(stream_summary(title, bool(request.json.get("refresh", False))), "summary", title=title)
         
-        result = run_crew(task_type="summarize", title=title)
+        result = run_crew(task_type="summarize", title=title, force_refresh=bool(request.json.get("refresh", False)))
         if not result or "output" not in result:
             return jsonify({"error": "Failed to generate summary"}), 500
             
@@ -79,7 +166,7 @@ def create_mcq():
         if not title:
             return jsonify({"error": "Title is required"}), 400
         
-        result = run_crew(task_type="mcq", title=title)
+        result = run_crew(task_type="mcq", title=title, force_refresh=bool(request.json.get("refresh", False)))
         if not result or "output" not in result:
             return jsonify({"error": "Failed to generate MCQs"}), 500
             
@@ -95,8 +182,14 @@ def chatbot():
         query = data.get("query")
         if not query:
             return jsonify({"error": "Query is required"}), 400
+
+        # Optional "title" or "titles" restrict retrieval to those papers
+        titles = data.get("titles") or data.get("title")
+
+        if wants_stream(data):
+            return sse_response(stream_query_answer(query, titles), "response", query=query)
         
-        result = run_crew(task_type="chatbot", title=None, query=query)
+        result = run_crew(task_type="chatbot", title=None, query=query, titles=titles)
         if not result or "output" not in result:
             return jsonify({"error": "Failed to generate response"}), 500
             
@@ -105,21 +198,75 @@ def chatbot():
         logging.error(f"Error in /chatbot: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
     
+@app.route('/chatbot/batch', methods=['POST'])
+def chatbot_batch():
+    try:
+        data = request.json or {}
+        queries = data.get("queries")
+        if not isinstance(queries, list) or not queries:
+            return jsonify({"error": "queries must be a non-empty list"}), 400
+        if len(queries) > Config.CHATBOT_BATCH_MAX_QUERIES:
+            return jsonify({"error": f"At most {Config.CHATBOT_BATCH_MAX_QUERIES} queries per batch"}), 400
+
+        titles = data.get("titles") or data.get("title")
+        return jsonify({"results": answer_queries_batch(queries, titles)}), 200
+    except Exception as e:
+        logging.error(f"Error in /chatbot/batch: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/fetch-titles', methods=['GET'])
 def fetch_titles():
     try:
-        conn = db_connection()
-        if not conn:
-            return jsonify({"error": "Failed to connect to database"}), 500
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT title FROM public.data")
-        titles = [row[0] for row in cur.fetchall()]
-        cur.close()
-        conn.close()
+        titles = fetch_paper_titles()
         return jsonify({"titles": titles}), 200
     except Exception as e:
         logging.error(f"Error in /fetch-titles: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
+
+def attachment_disposition(filename):
+    """
+    Content-Disposition for a download, as Flask's send_file builds it: a
+    quoted ASCII fallback name plus the exact name RFC 5987-encoded in UTF-8.
+    """
+    fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    fallback = "".join(c for c in fallback if c.isprintable() and c not in '"\\')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='!#$&+^`|~')}"
+
+@app.route('/download/<path:title>', methods=['GET'])
+def download_pdf(title):
+    try:
+        pdf = get_pdf_and_title(title)
+        if not pdf:
+            return jsonify({"error": "PDF not found"}), 404
+
+        headers = {
+            "Content-Disposition": attachment_disposition(f"{pdf['title']}.pdf"),
+            "Content-Length": str(pdf["size"]),
+        }
+        if pdf["sha256"]:
+            headers["ETag"] = f'"{pdf["sha256"]}"'
+        return Response(iter_pdf_chunks(pdf), mimetype="application/pdf", headers=headers)
+    except Exception as e:
+        logging.error(f"Error in /download: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/pool-stats', methods=['GET'])
+def fetch_pool_stats():
+    return jsonify({"pool": pool_stats()}), 200
+
+@app.route('/cache-stats', methods=['GET'])
+def fetch_cache_stats():
+    return jsonify({
+        "semantic_cache": get_semantic_cache().stats(),
+        "embeddings": embedding_service.stats(),
+    }), 200
     
 if __name__ == "__main__":
+    # Development server only; run production with: gunicorn -c gunicorn.conf.py wsgi:app
+    if Config.WARM_UP_ON_START:
+        warm_up()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,437 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from config import Config
+from instrumentation import configure_logging
+from pdf_benchmark import WORDS, generate_corpus
+
+# Every paper the benchmark stores has a title starting with this, and is
+# deleted again when the run finishes
+BENCH_PREFIX = "benchmark-"
+
+# Chunk texts and queries are drawn from WORDS, so full-text search has matches
+MOCK_ANSWER = "This is a mocked answer from the benchmark Gemini server."
+
+STAGES = ("embedding", "ingest", "retrieval", "chatbot")
+DATABASE_STAGES = ("ingest", "retrieval", "chatbot")
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    """Answers generateContent and streamGenerateContent after a fixed delay."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        body = {"candidates": [{"content": {"parts": [{"text": MOCK_ANSWER}]}}]}
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+            return
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_gemini(latency):
+    """
+    Serve a mock Gemini API on a free local port in a background thread and
+    point the shared LLM client at it. Returns the server; call shutdown() on it.
+    """
+    from llm_client import close_llm_client
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockGeminiHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, name="mock-gemini", daemon=True).start()
+
+    Config.GEMINI_API_BASE = f"http://127.0.0.1:{server.server_address[1]}/v1beta"
+    Config.GEMINI_API_KEY = Config.GEMINI_API_KEY or "benchmark"
+    close_llm_client()
+    return server
+
+
+def latency_summary(seconds):
+    """Percentiles of a list of durations, in milliseconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "count": int(ms.size),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def _sentences(rng, count, words):
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+
+def bench_embedding(rng, texts=512, queries=200):
+    """Batch encode throughput on chunk-sized texts, and single-query latency."""
+    from utils.embeddings import generate_embeddings, generate_embeddings_batch
+
+    chunk_texts = _sentences(rng, texts, 150)
+    generate_embeddings_batch(chunk_texts[:8])
+    started = time.perf_counter()
+    generate_embeddings_batch(chunk_texts)
+    elapsed = time.perf_counter() - started
+
+    # Distinct texts, so the embedding cache never answers
+    latencies = []
+    for query in _sentences(rng, queries, 12):
+        started = time.perf_counter()
+        generate_embeddings(query)
+        latencies.append(time.perf_counter() - started)
+
+    return {
+        "backend": Config.EMBEDDING_BACKEND,
+        "texts": texts,
+        "seconds": round(elapsed, 3),
+        "texts_per_sec": round(texts / elapsed, 1),
+        "query_latency": latency_summary(latencies),
+    }
+
+
+def bench_ingest(scratch, papers, pages, workers):
+    """Bulk-ingest a generated PDF corpus, then re-ingest it unchanged."""
+    from bulk_ingest import bulk_ingest
+
+    corpus = generate_corpus(scratch, papers, pages, prefix=BENCH_PREFIX + "paper")
+    first = bulk_ingest(corpus, workers=workers)
+    second = bulk_ingest(corpus, workers=workers)
+    return {
+        "pdfs": papers,
+        "pages_per_pdf": pages,
+        "stored": first["stored"],
+        "failed": first["failed"],
+        "chunks": first["chunks"],
+        "seconds": round(first["seconds"], 3),
+        "pdfs_per_sec": round(first["stored"] / first["seconds"], 2) if first["seconds"] else 0.0,
+        "chunks_per_sec": round(first["chunks"] / first["seconds"], 1) if first["seconds"] else 0.0,
+        "reingest_unchanged": second["unchanged"],
+        "reingest_seconds": round(second["seconds"], 3),
+    }
+
+
+def _unit(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+class SyntheticCorpus:
+    """
+    Papers of random chunks with clustered embeddings: every paper has a topic
+    vector, and its chunks (and the queries about it) lie close to that topic,
+    so searches return results within the retrieval distance cutoff.
+    """
+
+    def __init__(self, rng, chunks_per_paper=50):
+        self.rng = rng
+        self.np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+        self.chunks_per_paper = chunks_per_paper
+        self.topics = []
+
+    def _near(self, topic, count):
+        noise = _unit(self.np_rng.standard_normal((count, Config.EMBEDDING_DIM)))
+        return _unit(topic + 0.5 * noise)
+
+    def grow(self, chunk_count, batch_papers=20):
+        """Store synthetic papers until the corpus holds chunk_count chunks."""
+        from vector_db import store_papers_bulk
+
+        while len(self.topics) * self.chunks_per_paper < chunk_count:
+            papers = []
+            for _ in range(batch_papers):
+                if len(self.topics) * self.chunks_per_paper >= chunk_count:
+                    break
+                title = f"{BENCH_PREFIX}synthetic_{len(self.topics):06d}"
+                topic = _unit(self.np_rng.standard_normal(Config.EMBEDDING_DIM))
+                self.topics.append(topic)
+                chunks = []
+                offset = 0
+                for index, text in enumerate(_sentences(self.rng, self.chunks_per_paper, 150)):
+                    chunks.append({
+                        "chunk_index": index, "content": text, "page_start": index // 3 + 1,
+                        "page_end": index // 3 + 1, "char_start": offset, "char_end": offset + len(text),
+                        "section": f"Section {index // 10 + 1}",
+                    })
+                    offset += len(text) + 1
+                papers.append({
+                    "title": title,
+                    "content": "\n".join(chunk["content"] for chunk in chunks),
+                    "embedding": topic,
+                    "file_binary": f"%PDF-1.4 {title}".encode("utf-8"),
+                    "chunks": chunks,
+                    "chunk_embeddings": self._near(topic, len(chunks)),
+                })
+            store_papers_bulk(papers)
+
+    def queries(self, count):
+        """(query embedding, query text) pairs about random stored papers."""
+        topics = [self.rng.choice(self.topics) for _ in range(count)]
+        embeddings = [self._near(topic, 1)[0] for topic in topics]
+        return list(zip(embeddings, _sentences(self.rng, count, 8)))
+
+
+def bench_retrieval(rng, sizes, queries):
+    """
+    Retrieval latency at growing corpus sizes: queries one at a time through
+    custom_data_retriever, then all at once through batch_data_retriever.
+    """
+    from db import get_connection
+    from model import batch_data_retriever, custom_data_retriever
+
+    corpus = SyntheticCorpus(rng)
+    results = []
+    for size in sorted(sizes):
+        corpus.grow(size)
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("ANALYZE public.chunks")
+            cur.execute("SELECT count(*) FROM public.chunks")
+            total_chunks = cur.fetchone()[0]
+            conn.commit()
+
+        pairs = corpus.queries(queries)
+        for embedding, text in pairs[:10]:
+            custom_data_retriever(embedding, text)
+
+        latencies = []
+        returned = 0
+        for embedding, text in pairs:
+            started = time.perf_counter()
+            returned += len(custom_data_retriever(embedding, text))
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        batch_data_retriever([embedding for embedding, _ in pairs], [text for _, text in pairs])
+        batch_seconds = time.perf_counter() - started
+
+        results.append({
+            "corpus_chunks": size,
+            "table_chunks": total_chunks,
+            "latency": latency_summary(latencies),
+            "mean_results": round(returned / len(pairs), 2),
+            "batch_queries": len(pairs),
+            "batch_seconds": round(batch_seconds, 3),
+            "batch_ms_per_query": round(batch_seconds * 1000 / len(pairs), 3),
+        })
+    return results
+
+
+def bench_chatbot(rng, queries, batch_size):
+    """
+    End-to-end latency of POST /chatbot through the Flask app against the mock
+    Gemini server, and the throughput of the same queries via /chatbot/batch.
+    The semantic cache is disabled so every query takes the full path.
+    """
+    from app import app
+
+    Config.SEMANTIC_CACHE_ENABLED = False
+    client = app.test_client()
+    texts = _sentences(rng, queries, 10)
+    client.post("/chatbot", json={"query": texts[0]})
+
+    latencies = []
+    errors = 0
+    for query in texts:
+        started = time.perf_counter()
+        response = client.post("/chatbot", json={"query": query})
+        latencies.append(time.perf_counter() - started)
+        errors += response.status_code != 200
+
+    batch_texts = _sentences(rng, batch_size, 10)
+    started = time.perf_counter()
+    response = client.post("/chatbot/batch", json={"queries": batch_texts})
+    batch_seconds = time.perf_counter() - started
+    batch_errors = len(batch_texts) if response.status_code != 200 else sum(
+        1 for result in response.get_json()["results"] if result["error"]
+    )
+
+    return {
+        "latency": latency_summary(latencies),
+        "errors": errors,
+        "queries_per_sec": round(len(texts) / sum(latencies), 2),
+        "batch_queries": len(batch_texts),
+        "batch_seconds": round(batch_seconds, 3),
+        "batch_queries_per_sec": round(len(batch_texts) / batch_seconds, 2),
+        "batch_errors": batch_errors,
+    }
+
+
+def use_database(database):
+    """
+    Point the connection pool at the benchmark database (same server and
+    credentials as PG_*) and migrate its schema.
+    """
+    from db import close_pool
+    from schema import migrate
+
+    close_pool()
+    Config.PG_DATABASE = database
+    migrate()
+
+
+def cleanup():
+    """Delete every benchmark paper (chunks cascade) and its PDF blob."""
+    from db import get_connection
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM public.data WHERE left(title, %s) = %s RETURNING file_sha256",
+            (len(BENCH_PREFIX), BENCH_PREFIX)
+        )
+        hashes = [row[0] for row in cur.fetchall() if row[0]]
+        cur.execute(
+            """
+            DELETE FROM public.pdf_blobs b
+            WHERE b.sha256 = ANY(%s) AND NOT EXISTS (SELECT 1 FROM public.data d WHERE d.file_sha256 = b.sha256)
+            """,
+            (hashes,)
+        )
+        conn.commit()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items() if isinstance(results, dict) else enumerate(results):
+        name = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(previous, current):
+    """Print every numeric result of current next to previous, with the relative change."""
+    before = _flatten({stage: previous.get(stage) for stage in STAGES if previous.get(stage)})
+    after = _flatten({stage: current.get(stage) for stage in STAGES if current.get(stage)})
+    print(f"Compared with {previous.get('commit') or 'previous run'}:")
+    for name in sorted(set(before) & set(after)):
+        change = (after[name] - before[name]) / before[name] * 100 if before[name] else 0.0
+        print(f"  {name}: {before[name]} -> {after[name]} ({change:+.1f}%)")
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": multiprocessing.cpu_count(),
+        "config": {
+            "embedding_backend": Config.EMBEDDING_BACKEND,
+            "embedding_model": Config.EMBEDDING_MODEL_NAME,
+            "vector_index": Config.VECTOR_INDEX_METHOD,
+            "vector_search_recall": Config.VECTOR_SEARCH_RECALL,
+            "pdf_backend": Config.PDF_BACKEND,
+            "mock_llm_latency_ms": args.llm_latency_ms,
+            "database": args.database,
+        },
+    }
+    uses_database = bool(set(args.stages) & set(DATABASE_STAGES))
+    if uses_database:
+        use_database(args.database)
+    server = start_mock_gemini(args.llm_latency_ms / 1000)
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            stages = {
+                "embedding": lambda: bench_embedding(rng, args.embedding_texts, args.queries),
+                "ingest": lambda: bench_ingest(scratch, args.papers, args.pages, args.workers),
+                "retrieval": lambda: bench_retrieval(rng, args.corpus_sizes, args.queries),
+                "chatbot": lambda: bench_chatbot(rng, args.chatbot_queries, args.batch_size),
+            }
+            for stage in args.stages:
+                print(f"Running {stage} benchmark...")
+                try:
+                    results[stage] = stages[stage]()
+                except Exception as e:
+                    # A missing database or model fails its stages, not the run
+                    results[stage] = {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        server.shutdown()
+        if not args.keep and uses_database:
+            try:
+                cleanup()
+            except Exception as e:
+                print(f"Could not remove the benchmark papers: {e}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark embedding, ingestion, retrieval and /chatbot against a mock Gemini server. "
+                    "The ingest, retrieval and chatbot stages write to a separate benchmark database "
+                    "on the PG_* server, which they migrate and fill with synthetic papers."
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="timed queries per embedding and retrieval run")
+    parser.add_argument("--embedding-texts", type=int, default=512, help="chunk texts in the batch encode run")
+    parser.add_argument("--papers", type=int, default=20, help="PDFs in the generated ingest corpus")
+    parser.add_argument("--pages", type=int, default=10, help="pages per generated PDF")
+    parser.add_argument("--workers", type=int, default=None, help="ingest parser processes (default: CPU count)")
+    parser.add_argument(
+        "--corpus-sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+        help="synthetic chunks stored before each retrieval run",
+    )
+    parser.add_argument("--chatbot-queries", type=int, default=50, help="sequential /chatbot requests")
+    parser.add_argument("--batch-size", type=int, default=50, help="queries in the /chatbot/batch request")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="delay of each mock Gemini response")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark papers in the database")
+    parser.add_argument(
+        "--database", default=os.getenv("BENCH_PG_DATABASE"),
+        help="benchmark database (default: BENCH_PG_DATABASE); must differ from PG_DATABASE",
+    )
+    parser.add_argument(
+        "--i-know", action="store_true",
+        help="allow --database to be the application database PG_DATABASE",
+    )
+    args = parser.parse_args()
+    if set(args.stages) & set(DATABASE_STAGES):
+        if not args.database:
+            parser.error("set BENCH_PG_DATABASE or pass --database to name a scratch benchmark database")
+        if args.database == Config.PG_DATABASE and not args.i_know:
+            parser.error(
+                f"{args.database} is the application database (PG_DATABASE); "
+                "use a scratch database or pass --i-know"
+            )
+    configure_logging("WARNING")
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
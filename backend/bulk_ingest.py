@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from utils.pdf_parser import extract_layouts_from_source, read_pdf_source
+from instrumentation import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Only lightweight modules are imported at module level: parser workers are
+# spawned and re-import this module, and must not load the embedding model.
+
+
+def find_pdf_sources(path):
+    """
+    List the PDFs in a directory (recursively) or a zip archive as (path, member) sources.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return sorted((str(p), None) for p in path.rglob("*") if p.suffix.lower() == ".pdf")
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return sorted(
+                (str(path), name) for name in archive.namelist()
+                if name.lower().endswith(".pdf") and not name.startswith("__MACOSX/")
+            )
+    raise ValueError(f"{path} is neither a directory nor a zip archive")
+
+
+def source_title(source):
+    path, member = source
+    return Path(member or path).stem
+
+
+def _changed_sources(sources):
+    """
+    Drop sources whose file is identical to the one already stored under their
+    title. Returns the remaining sources and the SHA-256 of each one hashed.
+    """
+    from vector_db import get_paper_versions
+
+    versions = get_paper_versions([source_title(source) for source in sources])
+    changed = []
+    file_hashes = {}
+    for source in sources:
+        stored = versions.get(source_title(source))
+        if stored:
+            file_hashes[source] = hashlib.sha256(read_pdf_source(*source)).hexdigest()
+            if stored["file_sha256"] == file_hashes[source] and stored["chunks"]:
+                continue
+        changed.append(source)
+    return changed, file_hashes
+
+
+def _store_batch(batch):
+    """
+    Chunk, embed (one encode call for the whole batch, skipping chunks whose
+    content is already stored) and bulk-upsert parsed papers.
+    """
+    from ingest import embed_new_chunks, paper_embedding_from_chunks
+    from utils.chunker import chunk_pages
+    from vector_db import store_papers_bulk
+
+    if not batch:
+        return 0
+
+    all_chunks = [chunk_pages(paper["pages"], headings=paper["headings"]) for paper in batch]
+    all_embeddings = embed_new_chunks([paper["title"] for paper in batch], all_chunks)
+
+    papers = []
+    total = 0
+    for paper, chunks, chunk_embeddings in zip(batch, all_chunks, all_embeddings):
+        total += len(chunks)
+        if not chunks:
+            continue
+        papers.append({
+            "title": paper["title"],
+            "content": paper["content"],
+            "embedding": paper_embedding_from_chunks(chunk_embeddings),
+            "file_binary": read_pdf_source(*paper["source"]),
+            "file_sha256": paper["file_sha256"],
+            "chunks": chunks,
+            "chunk_embeddings": chunk_embeddings,
+        })
+
+    store_papers_bulk(papers)
+    return total
+
+
+def bulk_ingest(path, workers=None, batch_size=32, rebuild_index=False):
+    """
+    Ingest every PDF in a directory or zip archive. Re-runs are incremental:
+    files unchanged since they were stored are skipped before parsing, and
+    changed papers only have their new chunks embedded and written.
+    PDFs are parsed in parallel worker processes; chunks are embedded in batches
+    on the single model instance of this process and stored with multi-row INSERTs.
+    """
+    from schema import drop_vector_indexes, rebuild_vector_index
+
+    sources = find_pdf_sources(path)
+    found = len(sources)
+    sources, file_hashes = _changed_sources(sources)
+    logger.info("Found %s PDFs in %s, %s unchanged since the last run", found, path, found - len(sources))
+
+    if rebuild_index:
+        drop_vector_indexes("chunks")
+
+    started = time.perf_counter()
+    stored = failed = total_chunks = 0
+    try:
+        batch = []
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(extract_layouts_from_source, source): source for source in sources}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    layouts = future.result()
+                except Exception as e:
+                    logger.error("Failed to parse %s: %s", source_title(source), e)
+                    failed += 1
+                    continue
+
+                pages = [page.text for page in layouts]
+                content = "\n".join(pages).strip()
+                if not content:
+                    logger.error("No text extracted from %s", source_title(source))
+                    failed += 1
+                    continue
+
+                batch.append({
+                    "title": source_title(source),
+                    "pages": pages,
+                    "headings": [page.headings for page in layouts],
+                    "content": content,
+                    "source": source,
+                    "file_sha256": file_hashes.get(source),
+                })
+                if len(batch) >= batch_size:
+                    total_chunks += _store_batch(batch)
+                    stored += len(batch)
+                    batch = []
+
+            total_chunks += _store_batch(batch)
+            stored += len(batch)
+    finally:
+        # Also after a failed load: without it every query is a sequential scan
+        if rebuild_index:
+            rebuild_vector_index("chunks")
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Ingested %s papers (%s chunks, %s failed) in %.1fs: %.2f PDFs/s, %.1f chunks/s",
+        stored, total_chunks, failed, elapsed,
+        stored / elapsed if elapsed else 0, total_chunks / elapsed if elapsed else 0,
+    )
+    return {
+        "stored": stored, "unchanged": found - len(sources), "failed": failed, "chunks": total_chunks, "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory or zip archive of PDFs")
+    parser.add_argument("path", help="directory or .zip containing PDFs; titles are taken from file names")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=32, help="papers embedded and inserted per transaction")
+    parser.add_argument(
+        "--rebuild-index", action="store_true",
+        help="drop the chunks vector index before loading and rebuild it afterwards",
+    )
+    args = parser.parse_args()
+    configure_logging()
+    bulk_ingest(args.path, args.workers, args.batch_size, args.rebuild_index)
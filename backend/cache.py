@@ -0,0 +1,59 @@
+import logging
+from psycopg2.extras import Json
+from db import get_connection
+from schema import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+def get_cached_result(content_hash, task_type, prompt_version, model):
+    """Return the stored result for this paper content and task, or None."""
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
+        cur.execute(
+            """
+            SELECT result FROM public.llm_cache
+            WHERE content_hash = %s AND task_type = %s AND prompt_version = %s AND model = %s
+            """,
+            (content_hash, task_type, prompt_version, model)
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+
+def store_cached_result(content_hash, task_type, prompt_version, model, result):
+    """Insert or replace the stored result for this paper content and task."""
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
+        cur.execute(
+            """
+            INSERT INTO public.llm_cache (content_hash, task_type, prompt_version, model, result)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (content_hash, task_type, prompt_version, model)
+            DO UPDATE SET result = EXCLUDED.result, created_at = now()
+            """,
+            (content_hash, task_type, prompt_version, model, Json(result))
+        )
+        conn.commit()
+
+def cached_result(content_hash, task_type, prompt_version, model, compute, force_refresh=False):
+    """
+    Serve a stored LLM result for (content hash, task, prompt version, model),
+    calling compute() and storing its result on a miss or when force_refresh is set.
+    Empty results are not stored so that failed generations are retried.
+    Cache errors never fail the request; the result is just computed instead.
+    """
+    if not force_refresh:
+        try:
+            cached = get_cached_result(content_hash, task_type, prompt_version, model)
+            if cached is not None:
+                logger.debug("Cache hit for %s (%s)", task_type, content_hash[:12])
+                return cached
+        except Exception as e:
+            logger.error("Cache lookup failed: %s", e)
+
+    result = compute()
+    if result:
+        try:
+            store_cached_result(content_hash, task_type, prompt_version, model, result)
+        except Exception as e:
+            logger.error("Cache store failed: %s", e)
+    return result
@@ -12,6 +12,101 @@ class Config:
     PG_DATABASE = os.getenv("PG_DATABASE")
     
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+    GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+
+    # LLM client: timeouts in seconds, LLM_RATE_LIMIT in requests/second (0 = unlimited)
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+    LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+    LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+    LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+    LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "0"))
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
     
     PG_DB_URI = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DATABASE}"
 
+    # Connection pool
+    PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+    PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+    PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "30"))
+    PG_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("PG_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+    # Production server (gunicorn.conf.py); SERVER_WORKERS=0 starts one worker per CPU
+    SERVER_BIND = os.getenv("SERVER_BIND", "0.0.0.0:5000")
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+    SERVER_THREADS = int(os.getenv("SERVER_THREADS", "4"))
+    SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "180"))
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "60"))
+    # Where gunicorn workers record /metrics samples so any worker can report
+    # all of them; emptied when the server starts, one directory per server
+    METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "/tmp/paper-metrics")
+
+    # Load the embedding model, DB pool and LLM client at startup instead of on first use
+    WARM_UP_ON_START = os.getenv("WARM_UP_ON_START", "false").lower() == "true"
+
+    # Logging threshold (DEBUG, INFO, WARNING, ERROR); DEBUG traces every request stage
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+    # Embeddings / chunking
+    # EMBEDDING_BACKEND is one of torch, torch-int8 (dynamic quantization) or onnx;
+    # EMBEDDING_MODEL_PATH is the exported .onnx file used by the onnx backend
+    EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "models/all-MiniLM-L6-v2-int8.onnx")
+    EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+    EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    # Micro-batching of concurrent single-text encodes, and their LRU cache
+    EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+    EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+    EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+    # Vector index (see schema.py); VECTOR_SEARCH_RECALL is one of fast, balanced, accurate
+    VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "hnsw")
+    HNSW_M = int(os.getenv("HNSW_M", "16"))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+    IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "0"))
+    INDEX_MAINTENANCE_WORK_MEM = os.getenv("INDEX_MAINTENANCE_WORK_MEM", "512MB")
+    VECTOR_SEARCH_RECALL = os.getenv("VECTOR_SEARCH_RECALL", "balanced")
+
+    # Hybrid retrieval: candidates taken from each of the full-text and vector
+    # rankings before reciprocal rank fusion, and the RRF damping constant
+    FTS_LANGUAGE = os.getenv("FTS_LANGUAGE", "english")
+    RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "40"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    # Chunks further than this cosine distance from the query are never used as
+    # context (2 disables the cutoff); at most this many chunks per paper
+    RETRIEVAL_MAX_DISTANCE = float(os.getenv("RETRIEVAL_MAX_DISTANCE", "0.7"))
+    RETRIEVAL_MAX_CHUNKS_PER_PAPER = int(os.getenv("RETRIEVAL_MAX_CHUNKS_PER_PAPER", "2"))
+    # Token budget for retrieved context in a chatbot prompt (see context_packer.py)
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+    # Map-reduce summarization: papers longer than one section are summarized per section
+    SUMMARY_SECTION_CHARS = int(os.getenv("SUMMARY_SECTION_CHARS", "24000"))
+    SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+
+    # /chatbot/batch: most queries per request, and concurrent Gemini calls per batch
+    CHATBOT_BATCH_MAX_QUERIES = int(os.getenv("CHATBOT_BATCH_MAX_QUERIES", "256"))
+    CHATBOT_BATCH_CONCURRENCY = int(os.getenv("CHATBOT_BATCH_CONCURRENCY", "8"))
+
+    # Chatbot semantic answer cache (cosine similarity threshold, TTL in seconds)
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+    SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+    # PDF text extraction: pymupdf (default) or pypdf2. PDFs with at least
+    # PDF_PARALLEL_MIN_PAGES pages are parsed in page ranges across processes
+    PDF_BACKEND = os.getenv("PDF_BACKEND", "pymupdf")
+    PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "4"))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+
+    # PDF downloads
+    PDF_STREAM_CHUNK_BYTES = int(os.getenv("PDF_STREAM_CHUNK_BYTES", str(1024 * 1024)))
+
+    # Background jobs (uploads)
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
@@ -0,0 +1,107 @@
+from typing import Dict, List
+from langchain_core.documents import Document
+from config import Config
+from utils.embeddings import get_embedding_model
+
+# A passage that would be cut below this many tokens is left out instead
+MIN_PASSAGE_TOKENS = 32
+
+
+def _token_ends(text: str) -> List[int]:
+    """Character offset at which each token of text ends."""
+    encoding = get_embedding_model().tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False,
+    )
+    return [end for _, end in encoding["offset_mapping"]]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Number of tokens in text by the embedding model's tokenizer. WordPiece
+    splits more finely than Gemini's tokenizer, so this errs on the high side.
+    """
+    return len(_token_ends(text))
+
+
+def _uncovered(start: int, end: int, covered: List[tuple]) -> tuple:
+    """
+    Shrink [start, end) by the character ranges already packed from the same
+    paper. Returns None when the range is fully covered.
+    """
+    for covered_start, covered_end in covered:
+        if covered_start <= start and end <= covered_end:
+            return None
+        if covered_start <= start < covered_end:
+            start = covered_end
+        elif covered_start < end <= covered_end:
+            end = covered_start
+    return (start, end) if start < end else None
+
+
+def pack_context(documents: List[Document], budget: int = Config.CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    """
+    Assemble retrieved chunks into prompt passages within a token budget.
+
+    Chunks are taken in order of retrieval score. Text already packed from an
+    overlapping chunk of the same paper is trimmed off, and the last passage is
+    cut at a token boundary to fit the budget. Each passage keeps its title and
+    page range for citation.
+    """
+    passages = []
+    covered = {}
+    remaining = budget
+    for doc in sorted(documents, key=lambda d: d.metadata.get("score", 0.0), reverse=True):
+        if remaining < MIN_PASSAGE_TOKENS:
+            break
+        metadata = doc.metadata
+        text = doc.page_content
+        char_start, char_end = metadata.get("char_start"), metadata.get("char_end")
+        if char_start is not None and char_end is not None:
+            paper_ranges = covered.setdefault(metadata["paper_id"], [])
+            span = _uncovered(char_start, char_end, paper_ranges)
+            if span is None:
+                continue
+            text = text[span[0] - char_start:span[1] - char_start]
+            paper_ranges.append(span)
+
+        text = text.strip()
+        if not text:
+            continue
+        token_ends = _token_ends(text)
+        if len(token_ends) > remaining:
+            text = text[:token_ends[remaining - 1]].rstrip() + " ..."
+        remaining -= min(len(token_ends), remaining)
+
+        passages.append({
+            "text": text,
+            "title": metadata.get("title", "Unknown"),
+            "paper_id": metadata.get("paper_id"),
+            "page_start": metadata.get("page_start"),
+            "page_end": metadata.get("page_end"),
+            "section": metadata.get("section"),
+            "score": metadata.get("score"),
+        })
+    return passages
+
+
+def citation(passage: Dict) -> str:
+    """Source of a passage as "Title, Section, p. 3" or "Title, pp. 3-4"."""
+    source = passage["title"]
+    if passage.get("section"):
+        source += f", {passage['section']}"
+    start, end = passage["page_start"], passage["page_end"]
+    if start is None:
+        return source
+    if end is None or end == start:
+        return f"{source}, p. {start}"
+    return f"{source}, pp. {start}-{end}"
+
+
+def format_context(passages: List[Dict]) -> str:
+    """Numbered passages, each headed by its citation."""
+    return "\n\n".join(
+        f"[{number}] {citation(passage)}\n{passage['text']}" for number, passage in enumerate(passages, 1)
+    )
@@ -1,22 +1,23 @@
 # # This file is part of the CrewAI project.
-from crewai import Crew, Task 
 from agents import mcq_generation_task, query_answering_task, summarization_task
 
 
-def run_crew(task_type: str, title: str, query: str = None):
+def run_crew(task_type: str, title: str, query: str = None, force_refresh: bool = False, titles=None):
     """
     Run the appropriate crew task based on the task type.
+    force_refresh bypasses the cached summary / MCQ result; titles restricts
+    the chatbot's retrieval to those papers.
     """
     if task_type == "summarize":
-        result = summarization_task(title)
+        result = summarization_task(title, force_refresh=force_refresh)
         return {"output": result}
     
     elif task_type == "mcq":
-        result = mcq_generation_task(title)
+        result = mcq_generation_task(title, force_refresh=force_refresh)
         return {"output": result}
     
     elif task_type == "chatbot" and query:
-        result = query_answering_task(query)  # No title needed
+        result = query_answering_task(query, titles=titles)
         return {"output": result}
     
     else:
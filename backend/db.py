@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+from pgvector.psycopg2 import register_vector
+from config import Config
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection that remembers which statements it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class _VectorConnectionPool(pg_pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool whose connections understand the pgvector type and
+    stay open while idle. psycopg2 closes a returned connection once minconn
+    connections are idle, which under concurrent load means reconnecting (and
+    re-preparing statements) on most checkouts; here up to maxconn are kept.
+    """
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        register_vector(conn)
+        conn.commit()
+        return conn
+
+    def _putconn(self, conn, key=None, close=False):
+        # Called with the pool lock held; minconn is only read here and when
+        # the pool is created
+        minconn, self.minconn = self.minconn, self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool shared by the whole process.
+
+    Wraps psycopg2's ThreadedConnectionPool so that callers block (up to a
+    timeout) instead of failing when all connections are checked out, keeps
+    returned connections open up to maxconn, checks idle connections before
+    handing them out and keeps usage metrics. Every
+    connection has the pgvector adapter registered, so numpy arrays can be
+    passed as vector parameters. Vector columns come back as pgvector.Vector
+    objects (pgvector 0.5); convert them with to_numpy() before doing math.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=30.0, health_check_interval=30.0, **connect_kwargs):
+        self._pool = _VectorConnectionPool(
+            minconn, maxconn, connection_factory=PooledConnection, **connect_kwargs
+        )
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._checkouts = 0
+        self._in_use = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._replaced = 0
+
+    def getconn(self, timeout=None):
+        """Check out a healthy connection, waiting for a free slot if necessary."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available after {timeout}s")
+        waited = time.perf_counter() - started
+
+        try:
+            conn = self._healthy(self._pool.getconn())
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool; broken connections are discarded."""
+        try:
+            if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            self._pool.putconn(conn, close=close)
+            with self._lock:
+                if close or conn.closed:
+                    self._last_used.pop(id(conn), None)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _healthy(self, conn):
+        """
+        Ping connections that have been idle longer than the health check
+        interval and replace them if the server no longer answers.
+        """
+        last_used = self._last_used.get(id(conn))
+        idle_for = time.monotonic() - last_used if last_used is not None else 0.0
+        if not conn.closed and idle_for < self.health_check_interval:
+            return conn
+
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except psycopg2.Error:
+            self._pool.putconn(conn, close=True)
+            with self._lock:
+                self._last_used.pop(id(conn), None)
+                self._replaced += 1
+            return self._pool.getconn()
+
+    def stats(self):
+        """Snapshot of pool usage metrics."""
+        with self._lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "wait_time_total_s": round(self._wait_time_total, 6),
+                "wait_time_avg_s": round(self._wait_time_total / self._checkouts, 6) if self._checkouts else 0.0,
+                "wait_time_max_s": round(self._wait_time_max, 6),
+                "timeouts": self._timeouts,
+                "replaced_connections": self._replaced,
+            }
+
+    def closeall(self):
+        self._pool.closeall()
+        with self._lock:
+            self._last_used.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    Config.PG_POOL_MIN_SIZE,
+                    Config.PG_POOL_MAX_SIZE,
+                    timeout=Config.PG_POOL_TIMEOUT,
+                    health_check_interval=Config.PG_POOL_HEALTH_CHECK_INTERVAL,
+                    dbname=Config.PG_DATABASE,
+                    user=Config.PG_USER,
+                    password=Config.PG_PASSWORD,
+                    host=Config.PG_HOST,
+                    port=Config.PG_PORT,
+                )
+                logger.info("Created connection pool for %s on %s:%s", Config.PG_DATABASE, Config.PG_HOST, Config.PG_PORT)
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection; the next get_pool() call starts a fresh pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def reset_pool_after_fork():
+    """
+    Forget a pool inherited from the parent process without closing it: its
+    connections belong to the parent. Call first thing in a forked worker.
+    """
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+@contextmanager
+def get_connection():
+    """
+    Check out a pooled connection for the duration of a with block.
+    Uncommitted work is rolled back when the connection is returned.
+    """
+    with span("db_connect"):
+        pool = get_pool()
+        conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def execute_prepared(cur, name, statement, params):
+    """
+    Run statement as a server-side prepared statement, preparing it the first
+    time it is used on the cursor's connection. statement uses $1, $2, ...
+    placeholders; params are bound in that order.
+    """
+    conn = cur.connection
+    if name not in conn.prepared_statements:
+        cur.execute(f"PREPARE {name} AS {statement}")
+        conn.prepared_statements.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+def pool_stats():
+    """Pool metrics, or None if the pool has not been created yet."""
+    return _pool.stats() if _pool is not None else None
@@ -0,0 +1,87 @@
+import argparse
+import logging
+import sys
+import time
+import numpy as np
+from config import Config
+from utils.embedding_backends import export_onnx, load_embedding_backend
+from instrumentation import configure_logging
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+# Lowest acceptable cosine similarity between a candidate's and torch's embedding of any text
+MIN_COSINE = 0.99
+
+
+def sample_chunks(limit):
+    """Random chunk texts from the database, as a realistic comparison corpus."""
+    from db import get_connection
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT content FROM public.chunks ORDER BY random() LIMIT %s", (limit,))
+        return [row[0] for row in cur.fetchall()]
+
+
+def timed_encode(backend, texts, batch_size):
+    backend.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    start = time.perf_counter()
+    embeddings = backend.encode(texts, batch_size=batch_size)
+    return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - start
+
+
+def compare_backends(texts, candidate, reference="torch", model_path=None, batch_size=Config.EMBEDDING_BATCH_SIZE):
+    """
+    Encode texts with the reference and candidate backends and return the
+    per-text cosine similarity summary and the encode throughput of each.
+    """
+    reference_embeddings, reference_seconds = timed_encode(load_embedding_backend(reference), texts, batch_size)
+    candidate_embeddings, candidate_seconds = timed_encode(
+        load_embedding_backend(candidate, model_path=model_path), texts, batch_size
+    )
+    # Both backends return L2-normalised vectors, so the row-wise dot product is the cosine
+    similarities = np.sum(reference_embeddings * candidate_embeddings, axis=1)
+    return {
+        "texts": len(texts),
+        "cosine_mean": float(similarities.mean()),
+        "cosine_min": float(similarities.min()),
+        "cosine_p01": float(np.percentile(similarities, 1)),
+        f"{reference}_texts_per_sec": round(len(texts) / reference_seconds, 1),
+        f"{candidate}_texts_per_sec": round(len(texts) / candidate_seconds, 1),
+        "speedup": round(reference_seconds / candidate_seconds, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and validate alternative embedding backends")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="export the embedding model to ONNX")
+    export.add_argument("--output", default=Config.EMBEDDING_MODEL_PATH)
+    export.add_argument("--quantize", action="store_true", help="quantize the exported weights to int8")
+
+    compare = subparsers.add_parser("compare", help="compare a backend against the reference torch backend")
+    compare.add_argument("--backend", choices=BACKENDS, default=Config.EMBEDDING_BACKEND)
+    compare.add_argument("--model-path", default=None, help="ONNX model (default: EMBEDDING_MODEL_PATH)")
+    compare.add_argument("--file", help="text file with one sample per line (default: random chunks from the database)")
+    compare.add_argument("--samples", type=int, default=500, help="number of chunks sampled from the database")
+    compare.add_argument("--min-cosine", type=float, default=MIN_COSINE, help="fail when any text scores below this")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.command == "export":
+        logger.info("Exported %s", export_onnx(Config.EMBEDDING_MODEL_NAME, args.output, args.quantize))
+    else:
+        if args.file:
+            with open(args.file, encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()]
+        else:
+            texts = sample_chunks(args.samples)
+        if not texts:
+            sys.exit("No texts to compare")
+
+        report = compare_backends(texts, args.backend, model_path=args.model_path)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        if report["cosine_min"] < args.min_cosine:
+            sys.exit(f"[ERROR] Minimum cosine similarity {report['cosine_min']:.4f} is below {args.min_cosine}")
@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import shutil
+import sys
+from config import Config
+
+# Set before the app (and prometheus_client) is imported, so every worker
+# records metrics into this directory and /metrics aggregates across workers
+shutil.rmtree(Config.METRICS_DIR, ignore_errors=True)
+os.makedirs(Config.METRICS_DIR)
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = Config.METRICS_DIR
+
+bind = Config.SERVER_BIND
+# Upload jobs run in the worker that accepted the upload, but their state is
+# kept in the jobs table, so a /jobs/<id> poll can land on any worker. A job
+# whose worker is killed mid-run stays "running" and has to be resubmitted.
+workers = Config.SERVER_WORKERS or multiprocessing.cpu_count()
+# Threaded workers: requests mostly wait on Gemini and Postgres, and SSE
+# responses hold a thread for the whole stream
+worker_class = "gthread"
+threads = Config.SERVER_THREADS
+timeout = Config.SERVER_TIMEOUT
+# On SIGTERM, workers stop accepting requests and get this long to finish
+# in-flight requests and ingestion jobs
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = 5
+
+# Import wsgi (and load the embedding model) in the master before forking
+preload_app = True
+
+
+def post_fork(server, worker):
+    """
+    Drop state inherited from the master that must not be shared between
+    processes, and split the CPU cores between workers for model inference.
+    """
+    from db import reset_pool_after_fork
+    from jobs import reset_job_queue_after_fork
+    from llm_client import reset_llm_client_after_fork
+
+    reset_pool_after_fork()
+    reset_llm_client_after_fork()
+    reset_job_queue_after_fork()
+
+    # Read when the ONNX backend is loaded in the worker
+    Config.EMBEDDING_THREADS = Config.EMBEDDING_THREADS or max(1, multiprocessing.cpu_count() // workers)
+    if "torch" in sys.modules:
+        import torch
+
+        torch.set_num_threads(Config.EMBEDDING_THREADS)
+
+    if Config.WARM_UP_ON_START:
+        from app import warm_up
+
+        warm_up()
+
+
+def worker_exit(server, worker):
+    """Let queued ingestion jobs finish, then close the worker's connections."""
+    from db import close_pool
+    from jobs import shutdown_job_queue
+    from llm_client import close_llm_client
+
+    shutdown_job_queue(wait=True)
+    close_llm_client()
+    close_pool()
+
+
+def child_exit(server, worker):
+    """Let the metrics of a dead worker stop counting as live."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
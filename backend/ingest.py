@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import numpy as np
+from config import Config
+from utils.pdf_parser import pdf_buffer, extract_page_layouts
+from utils.chunker import chunk_pages
+from utils.embeddings import generate_embeddings_batch
+from vector_db import (
+    store_to_pgvector, store_chunks, get_papers_without_chunks, get_paper_versions, get_chunk_embeddings,
+)
+from instrumentation import configure_logging
+
+logger = logging.getLogger(__name__)
+
+def paper_embedding_from_chunks(chunk_embeddings):
+    """
+    Paper-level embedding for the data table: the normalised mean of the chunk
+    embeddings, so the whole paper does not have to be encoded (and truncated) again.
+    """
+    mean = np.mean(np.asarray(chunk_embeddings, dtype=np.float32), axis=0)
+    norm = np.linalg.norm(mean)
+    return mean / norm if norm else mean
+
+def embed_new_chunks(titles, chunk_lists):
+    """
+    Embeddings for each list of chunks in chunk_lists. Chunks whose content is
+    already stored for one of the titles reuse the stored embedding; only the
+    remaining distinct texts are encoded, in one batch.
+    """
+    hashes = {chunk["content_hash"] for chunks in chunk_lists for chunk in chunks}
+    known = get_chunk_embeddings(titles, hashes)
+    new_texts = {}
+    for chunks in chunk_lists:
+        for chunk in chunks:
+            if chunk["content_hash"] not in known:
+                new_texts.setdefault(chunk["content_hash"], chunk["content"])
+    if new_texts:
+        known.update(zip(new_texts, generate_embeddings_batch(list(new_texts.values()))))
+    logger.debug("Embedded %s new chunks, reused %s stored embeddings", len(new_texts), len(hashes) - len(new_texts))
+
+    return [
+        np.asarray([known[chunk["content_hash"]] for chunk in chunks], dtype=np.float32).reshape(-1, Config.EMBEDDING_DIM)
+        for chunks in chunk_lists
+    ]
+
+def _no_progress(stage, **details):
+    pass
+
+def ingest_pdf(title, pdf_file, progress=_no_progress):
+    """
+    Parse, chunk, embed and store an uploaded PDF.
+    The PDF is mapped once and the same buffer is used for text extraction and
+    for the stored binary. PDFs opened from disk are parsed from the file, in
+    parallel page ranges when large.
+    Re-ingestion is incremental: a file identical to the one stored under the
+    title is skipped without parsing, and only chunks with new content are embedded.
+    progress(stage, **details) is called as each stage starts.
+    Returns None if no text could be extracted, otherwise the paper id, chunk
+    count and whether the stored paper was already up to date.
+    """
+    with pdf_buffer(pdf_file) as buffer, \
+            memoryview(buffer.getbuffer() if hasattr(buffer, "getbuffer") else buffer) as file_binary:
+        file_sha256 = hashlib.sha256(file_binary).hexdigest()
+        stored = get_paper_versions([title]).get(title)
+        if stored and stored["file_sha256"] == file_sha256 and stored["chunks"]:
+            logger.info("Paper '%s' is unchanged, skipping", title)
+            return {"paper_id": stored["paper_id"], "chunks": stored["chunks"], "unchanged": True}
+
+        progress("parsing")
+        path = getattr(pdf_file, "name", None)
+        layouts = extract_page_layouts(buffer, path=path if isinstance(path, str) and os.path.isfile(path) else None)
+        pages = [page.text for page in layouts]
+        text_content = "\n".join(pages).strip()
+        if not text_content:
+            return None
+
+        progress("chunking", pages=len(pages))
+        chunks = chunk_pages(pages, headings=[page.headings for page in layouts])
+
+        progress("embedding", chunks=len(chunks))
+        chunk_embeddings = embed_new_chunks([title], [chunks])[0]
+        embedding = paper_embedding_from_chunks(chunk_embeddings)
+
+        progress("storing")
+        paper_id = store_to_pgvector(
+            title, text_content, embedding, file_binary, chunks, chunk_embeddings, file_sha256=file_sha256
+        )
+
+    logger.info("Stored paper '%s' (id=%s) with %s chunks", title, paper_id, len(chunks))
+    return {"paper_id": paper_id, "chunks": len(chunks), "unchanged": False}
+
+def ingest_pdf_path(title, path, progress=_no_progress):
+    """
+    Ingest a PDF that was spooled to disk for a background job, removing the file afterwards.
+    Raises ValueError if no text could be extracted.
+    """
+    try:
+        with open(path, "rb") as pdf_file:
+            result = ingest_pdf(title, pdf_file, progress)
+    finally:
+        os.remove(path)
+    if not result:
+        raise ValueError("Failed to extract text from PDF")
+    return result
+
+def backfill_chunks():
+    """
+    Chunk and embed papers stored before chunked ingestion existed.
+    Page boundaries are not known for those papers, so their content is treated as a single page.
+    """
+    papers = get_papers_without_chunks()
+    logger.info("Backfilling chunks for %s papers", len(papers))
+    for paper_id, title, content in papers:
+        chunks = chunk_pages([content])
+        if not chunks:
+            continue
+        chunk_embeddings = generate_embeddings_batch([chunk["content"] for chunk in chunks])
+        store_chunks(paper_id, chunks, chunk_embeddings)
+        logger.info("Backfilled %s chunks for '%s'", len(chunks), title)
+
+if __name__ == "__main__":
+    configure_logging()
+    backfill_chunks()
@@ -0,0 +1,88 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Histogram, REGISTRY, generate_latest, multiprocess
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a pooled connection checkout to a long Gemini call
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def configure_logging(level=None):
+    """
+    Send log records to stderr at LOG_LEVEL (or level). Debug messages are
+    formatted only when enabled, so they cost next to nothing otherwise.
+    """
+    level = (level or Config.LOG_LEVEL).upper()
+    logging.basicConfig(format="%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s")
+    logging.getLogger().setLevel(level)
+    # httpx logs every Gemini request at INFO
+    logging.getLogger("httpx").setLevel(max(logging.getLevelName(level), logging.WARNING))
+
+
+STAGE_SECONDS = Histogram(
+    "paper_stage_duration_seconds",
+    "Time spent per processing stage (pdf_parse, embed, db_connect, vector_query, context_pack, llm_call, mcq_parse).",
+    ("stage", "outcome"),
+    buckets=DURATION_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "paper_http_request_duration_seconds",
+    "Time to produce an HTTP response (to the first byte for streamed responses).",
+    ("endpoint", "method", "status"),
+    buckets=DURATION_BUCKETS,
+)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the body of a with block as one occurrence of stage. Exceptions mark
+    the span as an error and propagate; a generator closed early counts as ok.
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage, outcome).observe(elapsed)
+        logger.debug("%s %s in %.1f ms", stage, outcome, elapsed * 1000)
+
+
+def observe_first_chunk(chunks, observe):
+    """
+    Pass the chunks of a streamed response body through, calling observe()
+    once the first chunk is ready (or the body ends empty or fails first).
+    """
+    observed = False
+    try:
+        for chunk in chunks:
+            if not observed:
+                observe()
+                observed = True
+            yield chunk
+    finally:
+        if not observed:
+            observe()
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def render_metrics():
+    """
+    Every metric in the Prometheus text exposition format. Under gunicorn,
+    PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py) and each worker
+    records into files there, so any worker's scrape covers all of them.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import Json
+from config import Config
+from db import get_connection
+from schema import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+INGEST_STAGES = ("parsing", "chunking", "embedding", "storing")
+
+
+class JobQueue:
+    """
+    Background job runner backed by a thread pool.
+
+    Each submitted function receives a progress(stage, **details) callback as
+    its `progress` keyword argument. Job state is written to the jobs table,
+    so any gunicorn worker can answer a status poll for a job run by another.
+    Finished jobs are deleted after `retention` seconds. A job whose worker
+    dies stays "running" in the table.
+    """
+
+    def __init__(self, max_workers, retention=3600):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        # State of the jobs submitted to this process that have not finished yet
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.retention = retention
+
+    def submit(self, fn, *args, stages=(), **kwargs):
+        """Queue fn(*args, progress=..., **kwargs) and return the new job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "stage": None,
+            "stages": {stage: "pending" for stage in stages},
+            "details": {},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            cur.execute(
+                """
+                DELETE FROM public.jobs
+                WHERE status IN ('succeeded', 'failed') AND updated_at < now() - make_interval(secs => %s)
+                """,
+                (self.retention,)
+            )
+            self._write(cur, job)
+            conn.commit()
+        with self._lock:
+            self._jobs[job_id] = job
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of a job's state, or None for an unknown id."""
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            cur.execute(
+                """
+                SELECT id, status, stage, stages, details, result, error,
+                       extract(epoch FROM created_at), extract(epoch FROM updated_at)
+                FROM public.jobs WHERE id = %s
+                """,
+                (job_id,)
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip(
+            ("id", "status", "stage", "stages", "details", "result", "error"), row[:7]
+        ), created_at=float(row[7]), updated_at=float(row[8]))
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status="running")
+        try:
+            result = fn(*args, progress=lambda stage, **details: self._progress(job_id, stage, details), **kwargs)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            self._finish(job_id, "failed", error=str(e))
+            return
+        self._finish(job_id, "succeeded", result=result)
+
+    def _progress(self, job_id, stage, details):
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["stage"] in job["stages"]:
+                job["stages"][job["stage"]] = "done"
+            job["stage"] = stage
+            job["stages"][stage] = "running"
+            job["details"].update(details)
+            job["updated_at"] = time.time()
+        self._save(job_id)
+
+    def _finish(self, job_id, status, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["stage"] in job["stages"]:
+                job["stages"][job["stage"]] = "done" if status == "succeeded" else status
+        self._update(job_id, status=status, **fields)
+        with self._lock:
+            del self._jobs[job_id]
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, updated_at=time.time())
+        self._save(job_id)
+
+    def _save(self, job_id):
+        """
+        Write a job's current state. A failed status write is logged rather
+        than failing the job itself.
+        """
+        with self._lock:
+            job = {**self._jobs[job_id]}
+            job["stages"], job["details"] = dict(job["stages"]), dict(job["details"])
+        try:
+            with get_connection() as conn, conn.cursor() as cur:
+                self._write(cur, job)
+                conn.commit()
+        except Exception as e:
+            logger.error("Could not save the state of job %s: %s", job_id, e)
+
+    @staticmethod
+    def _write(cur, job):
+        cur.execute(
+            """
+            INSERT INTO public.jobs (id, status, stage, stages, details, result, error, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, to_timestamp(%s), to_timestamp(%s))
+            ON CONFLICT (id) DO UPDATE SET
+                status = EXCLUDED.status,
+                stage = EXCLUDED.stage,
+                stages = EXCLUDED.stages,
+                details = EXCLUDED.details,
+                result = EXCLUDED.result,
+                error = EXCLUDED.error,
+                updated_at = EXCLUDED.updated_at
+            """,
+            (
+                job["id"], job["status"], job["stage"], Json(job["stages"]), Json(job["details"]),
+                Json(job["result"]), job["error"], job["created_at"], job["updated_at"],
+            )
+        )
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue, creating it on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(Config.JOB_WORKERS, retention=Config.JOB_RETENTION_SECONDS)
+    return _queue
+
+
+def shutdown_job_queue(wait=True):
+    """Stop the job queue, by default after running and queued jobs finish."""
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.shutdown(wait=wait)
+            _queue = None
+
+
+def reset_job_queue_after_fork():
+    """Forget a queue inherited from the parent process; its worker threads did not survive the fork."""
+    global _queue, _queue_lock
+    _queue = None
+    _queue_lock = threading.Lock()
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import httpx
+from config import Config
+from instrumentation import span
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when the LLM API call fails after all retries."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter: `rate` requests per second with bursts of up to
+    `capacity`. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return how long the caller must wait before using it."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class GeminiClient:
+    """
+    Gemini generateContent client shared by every LLM call site.
+
+    Keeps one pooled HTTP connection per host (sync and async), applies
+    connect/read timeouts, retries 429/5xx responses and transport errors with
+    exponential backoff and jitter (honouring Retry-After), rate-limits with a
+    token bucket and caps the number of in-flight requests.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        model=Config.GEMINI_MODEL,
+        base_url=Config.GEMINI_API_BASE,
+        timeout=Config.LLM_TIMEOUT,
+        connect_timeout=Config.LLM_CONNECT_TIMEOUT,
+        max_retries=Config.LLM_MAX_RETRIES,
+        backoff_base=Config.LLM_BACKOFF_BASE,
+        backoff_max=Config.LLM_BACKOFF_MAX,
+        rate_limit=Config.LLM_RATE_LIMIT,
+        max_concurrency=Config.LLM_MAX_CONCURRENCY,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self._rate_limiter = TokenBucket(rate_limit)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._client = httpx.Client(timeout=self._timeout, limits=self._limits, headers=self._headers())
+        self._async_client = None
+        self._async_semaphore = None
+
+    def _headers(self):
+        return {"Content-Type": "application/json", "x-goog-api-key": self.api_key or ""}
+
+    def url(self, method="generateContent"):
+        return f"{self.base_url}/models/{self.model}:{method}"
+
+    @staticmethod
+    def payload(prompt):
+        return {"contents": [{"parts": [{"text": prompt}]}]}
+
+    @staticmethod
+    def extract_text(data):
+        """Return the text of the first candidate of a generateContent response."""
+        candidates = data.get("candidates") or []
+        if not candidates:
+            raise LLMError(f"No candidates in response: {data}")
+        parts = candidates[0].get("content", {}).get("parts") or []
+        return "".join(part.get("text", "") for part in parts)
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _should_retry(self, attempt, response=None, error=None):
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            return isinstance(error, httpx.TransportError)
+        return response.status_code in RETRY_STATUS_CODES
+
+    @staticmethod
+    def _raise_for_response(response):
+        raise LLMError(f"Gemini API error {response.status_code}: {response.text}", response.status_code)
+
+    def generate(self, prompt):
+        """Generate a completion for prompt and return its text."""
+        attempt = 0
+        while True:
+            self._rate_limiter.acquire()
+            try:
+                with self._semaphore, span("llm_call"):
+                    response = self._client.post(self.url(), json=self.payload(prompt))
+            except httpx.HTTPError as e:
+                if not self._should_retry(attempt, error=e):
+                    raise LLMError(f"Gemini API request failed: {e}") from e
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code == 200:
+                return self.extract_text(response.json()).strip()
+            if not self._should_retry(attempt, response=response):
+                self._raise_for_response(response)
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def stream_generate(self, prompt):
+        """
+        Stream a completion for prompt, yielding text deltas as the server sends
+        them (streamGenerateContent with server-sent events). Failed attempts
+        are retried only until the first delta has been received.
+        """
+        attempt = 0
+        started = False
+        while True:
+            self._rate_limiter.acquire()
+            try:
+                with self._semaphore, span("llm_call"), self._client.stream(
+                    "POST", self.url("streamGenerateContent"), params={"alt": "sse"}, json=self.payload(prompt)
+                ) as response:
+                    if response.status_code == 200:
+                        for line in response.iter_lines():
+                            if line.startswith("data:"):
+                                text = self.extract_text(json.loads(line[len("data:"):]))
+                                if text:
+                                    started = True
+                                    yield text
+                        return
+                    response.read()
+            except httpx.HTTPError as e:
+                if started or not self._should_retry(attempt, error=e):
+                    raise LLMError(f"Gemini API request failed: {e}") from e
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if not self._should_retry(attempt, response=response):
+                self._raise_for_response(response)
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    async def agenerate(self, prompt):
+        """Async variant of generate, sharing the same rate limiter and retry policy."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits, headers=self._headers())
+            self._async_semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        attempt = 0
+        while True:
+            await self._rate_limiter.acquire_async()
+            try:
+                async with self._async_semaphore:
+                    with span("llm_call"):
+                        response = await self._async_client.post(self.url(), json=self.payload(prompt))
+            except httpx.HTTPError as e:
+                if not self._should_retry(attempt, error=e):
+                    raise LLMError(f"Gemini API request failed: {e}") from e
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code == 200:
+                return self.extract_text(response.json()).strip()
+            if not self._should_retry(attempt, response=response):
+                self._raise_for_response(response)
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def close(self):
+        self._client.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the process-wide Gemini client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient(api_key=Config.GEMINI_API_KEY, base_url=Config.GEMINI_API_BASE)
+    return _client
+
+
+def close_llm_client():
+    """Close the shared client; the next get_llm_client() call creates a new one."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def reset_llm_client_after_fork():
+    """Forget a client inherited from the parent process; its sockets belong to the parent."""
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
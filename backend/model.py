@@ -1,47 +1,133 @@
+import logging
 import re
-import requests
+import threading
 from config import Config
-from langchain.llms.base import LLM
+from llm_client import get_llm_client, LLMError
+from langchain_core.language_models.llms import LLM
 from typing import Optional, List, Mapping, Any
-from langchain.chains import RetrievalQA
 from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
-from utils.embeddings import generate_embeddings
-import psycopg2
-from psycopg2.extras import execute_values
+from utils.embeddings import generate_embeddings, generate_embeddings_batch
+import numpy as np
+from db import get_connection, execute_prepared
+from schema import apply_search_params
+from instrumentation import span
 
+logger = logging.getLogger(__name__)
 
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-pro:generateContent"
+
+GEMINI_MODEL = Config.GEMINI_MODEL
+
+# Returned by GeminiLLM when the API call fails; never cached
+LLM_ERROR_RESPONSE = "Sorry, I couldn't process your query."
+
+# Bump when the summary / MCQ prompts change so cached results are regenerated
+SUMMARY_PROMPT_VERSION = "2"
+MCQ_PROMPT_VERSION = "2"
+
+def _chunk_search_sql(filtered, vector="$1", text="$2"):
+    """
+    Hybrid search, prepared once per pooled connection. vector and text are the
+    query vector and query text ($1 and $2 for a single query), $3 is the
+    number of results, $4 the number of candidates taken from each ranking, $5
+    the maximum cosine distance, $6 the maximum chunks per paper and, when
+    filtered, $7 the titles to search.
+
+    The nearest chunks by cosine distance and the best full-text matches
+    (ts_rank_cd, normalised by document length) are fused with reciprocal rank
+    fusion: score = sum over rankings of 1 / (RRF_K + rank). Fused candidates
+    beyond the distance cutoff or the per-paper limit are dropped before any
+    paper row is read. Only subqueries are used, no CTEs, so the statement can
+    also run per query inside a LATERAL join.
+    """
+    # Restricted to a few papers, an exact scan of their chunks (through the
+    # paper_id index) beats an ANN scan that filters afterwards and can come up
+    # short; "+ 0" keeps the planner off the ANN index
+    paper_filter = "AND c.paper_id IN (SELECT id FROM data WHERE title = ANY($7))" if filtered else ""
+    vector_order = f"(c.embedding <=> {vector}) + 0" if filtered else f"c.embedding <=> {vector}"
+    return f"""
+    SELECT d.title, s.content, s.paper_id, s.chunk_index, s.page_start, s.page_end, s.id, d.content_hash,
+           s.score, s.distance, s.text_rank, s.char_start, s.char_end, s.section
+    FROM (
+        SELECT c.id, c.paper_id, c.content, c.chunk_index, c.page_start, c.page_end, c.char_start, c.char_end,
+               c.section, f.score, f.text_rank, c.embedding <=> {vector} AS distance,
+               row_number() OVER (PARTITION BY c.paper_id ORDER BY f.score DESC) AS paper_rank
+        FROM (
+            SELECT COALESCE(v.id, t.id) AS id,
+                   COALESCE(1.0 / ({Config.RRF_K} + v.rank), 0) + COALESCE(1.0 / ({Config.RRF_K} + t.rank), 0) AS score,
+                   t.text_rank
+            FROM (
+                SELECT id, row_number() OVER (ORDER BY distance) AS rank
+                FROM (
+                    SELECT c.id, c.embedding <=> {vector} AS distance
+                    FROM chunks c
+                    WHERE true {paper_filter}
+                    ORDER BY {vector_order}
+                    LIMIT $4
+                ) vector_hits
+            ) v
+            FULL OUTER JOIN (
+                SELECT id, text_rank, row_number() OVER (ORDER BY text_rank DESC) AS rank
+                FROM (
+                    SELECT c.id, ts_rank_cd(c.content_tsv, tsq.query, 1) AS text_rank
+                    FROM chunks c, websearch_to_tsquery('{Config.FTS_LANGUAGE}', {text}) AS tsq(query)
+                    WHERE c.content_tsv @@ tsq.query {paper_filter}
+                    ORDER BY text_rank DESC
+                    LIMIT $4
+                ) text_hits
+            ) t ON t.id = v.id
+        ) f
+        JOIN chunks c ON c.id = f.id
+        WHERE c.embedding <=> {vector} <= $5
+    ) s
+    JOIN data d ON d.id = s.paper_id
+    WHERE s.paper_rank <= $6
+    ORDER BY s.score DESC
+    LIMIT $3
+"""
+
+def _batch_chunk_search_sql(filtered):
+    """
+    The hybrid search for many queries in one statement: $1 holds the query
+    vectors and $2 the query texts; every row is prefixed with the 1-based
+    position of its query. The registered adapter sends each vector as an
+    untyped literal, so the array arrives as text[] and is cast here.
+    """
+    return f"""
+    SELECT q.position, r.*
+    FROM unnest($1::text[]::vector[], $2::text[]) WITH ORDINALITY AS q(embedding, query, position)
+    CROSS JOIN LATERAL ({_chunk_search_sql(filtered, vector="q.embedding", text="q.query")}) r
+    ORDER BY q.position, r.score DESC
+"""
+
+CHUNK_SEARCH_SQL = _chunk_search_sql(filtered=False)
+FILTERED_CHUNK_SEARCH_SQL = _chunk_search_sql(filtered=True)
+BATCH_CHUNK_SEARCH_SQL = _batch_chunk_search_sql(filtered=False)
+FILTERED_BATCH_CHUNK_SEARCH_SQL = _batch_chunk_search_sql(filtered=True)
 
 # Custom Embedding class
 class CustomSentenceTransformerEmbeddings(Embeddings):
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        print(f"[DEBUG] embed_documents called with {len(texts)} texts")
-        return [generate_embeddings(text) for text in texts]
+        logger.debug("embed_documents called with %s texts", len(texts))
+        return generate_embeddings_batch(texts).tolist()
 
     def embed_query(self, text: str) -> List[float]:
-        print(f"[DEBUG] embed_query called with: {text[:50]}...")
+        logger.debug("embed_query called with: %s...", text[:50])
         embedding = generate_embeddings(text)
-        print(f"[DEBUG] Generated query embedding of length: {len(embedding)}")
-        return embedding
+        logger.debug("Generated query embedding of length: %s", len(embedding))
+        return embedding.tolist()
     
 # Custom Gemini LLM class
 class GeminiLLM(LLM):
     api_key: str
-    model: str = "gemini-1.5-pro"
-    url: str = GEMINI_API_URL
+    model: str = GEMINI_MODEL
 
     def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}]
-        }
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(f"{self.url}?key={self.api_key}", json=payload, headers=headers)
-        if response.status_code == 200:
-            return response.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
-        else:
-            print(f"[ERROR] Gemini API Error: {response.status_code} - {response.text}")
-            return "Sorry, I couldn't process your query."
+        try:
+            return get_llm_client().generate(prompt)
+        except LLMError as e:
+            logger.error("Gemini API Error: %s", e)
+            return LLM_ERROR_RESPONSE
 
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
@@ -52,160 +138,174 @@ class GeminiLLM(LLM):
         return "gemini"
     
 
-def custom_data_retriever(query_embedding: List[float], k: int = 5) -> List[Document]:
+def _search_params(k, max_distance, max_per_paper):
+    """Shared ($3..$6) parameters of the chunk search statements."""
+    candidates = max(k, Config.RETRIEVAL_CANDIDATES)
+    if max_distance is None:
+        max_distance = Config.RETRIEVAL_MAX_DISTANCE
+    if max_per_paper is None:
+        max_per_paper = Config.RETRIEVAL_MAX_CHUNKS_PER_PAPER
+    return (k, candidates, max_distance, max_per_paper)
+
+def _chunk_document(row) -> Document:
+    return Document(
+        page_content=row[1],
+        metadata={
+            "title": row[0],
+            "paper_id": row[2],
+            "chunk_index": row[3],
+            "page_start": row[4],
+            "page_end": row[5],
+            "chunk_id": row[6],
+            "content_hash": row[7],
+            "score": float(row[8]),
+            "distance": float(row[9]),
+            "text_rank": float(row[10]) if row[10] is not None else None,
+            "char_start": row[11],
+            "char_end": row[12],
+            "section": row[13],
+        }
+    )
+
+def custom_data_retriever(
+    query_embedding,
+    query: str = "",
+    k: int = 5,
+    titles=None,
+    max_distance: Optional[float] = None,
+    max_per_paper: Optional[int] = None,
+) -> List[Document]:
     """
-    Perform a similarity search on the data table's embedding column across all papers.
-    Returns the top k documents with their titles in metadata.
+    Hybrid full-text and vector search over the chunks of all papers (or only of
+    titles, a title or list of titles), in one round trip. Returns at most k
+    chunks by fused score, none further than max_distance in cosine distance
+    from the query and at most max_per_paper from any one paper, as documents
+    with their paper title, page range and relevance scores in metadata.
+    Without query text the search is vector only.
     """
-    conn = None
     try:
-        conn = psycopg2.connect(
-            dbname=Config.PG_DATABASE,
-            user=Config.PG_USER,
-            password=Config.PG_PASSWORD,
-            host=Config.PG_HOST,
-            port=Config.PG_PORT
-        )
-        cur = conn.cursor()
-
-        # Convert query_embedding to vector string
-        query_vector = f"[{','.join(map(str, query_embedding))}]"
-
-        # Cosine similarity query across all papers
-        cur.execute(
-            """
-            SELECT title, content
-            FROM data
-            ORDER BY embedding <=> %s
-            LIMIT %s
-            """,
-            (query_vector, k)
-        )
-        results = cur.fetchall()
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        search_params = _search_params(k, max_distance, max_per_paper)
+        params = (query_vector, query) + search_params
+
+        with get_connection() as conn, conn.cursor() as cur, span("vector_query"):
+            apply_search_params(cur, search_params[1])
+            if titles:
+                titles = [titles] if isinstance(titles, str) else list(titles)
+                execute_prepared(cur, "chunk_search_filtered", FILTERED_CHUNK_SEARCH_SQL, params + (titles,))
+            else:
+                execute_prepared(cur, "chunk_search", CHUNK_SEARCH_SQL, params)
+            results = cur.fetchall()
 
         # Convert to LangChain Documents
-        documents = [
-            Document(
-                page_content=row[1],
-                metadata={"title": row[0]}
-            )
-            for row in results
-        ]
+        documents = [_chunk_document(row) for row in results]
 
-        print(f"[DEBUG] Retrieved {len(documents)} documents across all papers")
+        logger.debug("Retrieved %s chunks across all papers", len(documents))
         if documents:
-            print(f"[DEBUG] Top matching paper title: {documents[0].metadata['title']}")
+            logger.debug("Top matching paper title: %s", documents[0].metadata['title'])
         return documents
 
     except Exception as e:
-        print(f"[ERROR] Custom retriever error: {e}")
+        logger.error("Custom retriever error: %s", e)
         return []
-    finally:
-        if conn:
-            cur.close()
-            conn.close()
 
-# Initialize embeddings and LLM
-print("[DEBUG] Initializing CustomSentenceTransformerEmbeddings")
-embeddings = CustomSentenceTransformerEmbeddings()
+def batch_data_retriever(
+    query_embeddings,
+    queries: List[str],
+    k: int = 5,
+    titles=None,
+    max_distance: Optional[float] = None,
+    max_per_paper: Optional[int] = None,
+) -> List[List[Document]]:
+    """
+    custom_data_retriever for many queries at once: one statement on one
+    connection, running the hybrid search per query in a LATERAL join.
+    Returns one list of documents per query, in query order. Errors propagate.
+    """
+    vectors = [np.asarray(embedding, dtype=np.float32) for embedding in query_embeddings]
+    search_params = _search_params(k, max_distance, max_per_paper)
+    params = (vectors, list(queries)) + search_params
+
+    with get_connection() as conn, conn.cursor() as cur, span("vector_query"):
+        apply_search_params(cur, search_params[1])
+        if titles:
+            titles = [titles] if isinstance(titles, str) else list(titles)
+            execute_prepared(
+                cur, "batch_chunk_search_filtered", FILTERED_BATCH_CHUNK_SEARCH_SQL, params + (titles,)
+            )
+        else:
+            execute_prepared(cur, "batch_chunk_search", BATCH_CHUNK_SEARCH_SQL, params)
+        results = cur.fetchall()
+
+    documents = [[] for _ in queries]
+    for row in results:
+        documents[row[0] - 1].append(_chunk_document(row[1:]))
+    logger.debug("Retrieved %s chunks for %s queries", len(results), len(queries))
+    return documents
+
+_llm = None
+_llm_lock = threading.Lock()
 
-print("[DEBUG] Creating GeminiLLM")
-llm = GeminiLLM(api_key=Config.GEMINI_API_KEY)
+def get_llm():
+    """Return the shared GeminiLLM, creating it on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = GeminiLLM(api_key=Config.GEMINI_API_KEY)
+    return _llm
+
+def summary_prompt(content):
+    return f"summarize this: {content} in short"
 
 def summarize_text(content):
     """
     Summarize the given content using Gemini API.
     """
     try:
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": f"summarize this: {content} in short"
-                        }
-                    ]
-                }
-            ]
-        }
-        headers = {"Content-Type": "application/json"}
-        url = GEMINI_API_URL
-        api_key = Config.GEMINI_API_KEY 
-
-        response = requests.post(f"{url}?key={api_key}", json=payload, headers=headers)
-
-        # Debugging response
-        print(f"[DEBUG] Summary API Response: {response.text}")
-
-        # Parse and return the summary
-        if response.status_code == 200:
-            result = response.json()
-            summary = result["candidates"][0]["content"]["parts"][0]["text"]
-            return summary.strip()
-        else:
-            print(f"[ERROR] API Error: {response.text}")
-            return ""
+        summary = get_llm_client().generate(summary_prompt(content))
+        logger.debug("Summary length: %s", len(summary))
+        return summary
 
     except Exception as e:
-        print(f"[ERROR] Failed to call Gemini API: {e}")
+        logger.error("Failed to call Gemini API: %s", e)
         return ""
 
 def mcq_generate(content):
     try:
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": (
-                                f"Create 5 MCQ questions with four options each and the correct answer. "
-                                f"The questions should be based on the following content: {content}"
-                            )
-                        }
-                    ]
-                }
-            ]
-        }
-        headers = {"Content-Type": "application/json"}
-        url = GEMINI_API_URL
-        api_key = Config.GEMINI_API_KEY
-        response = requests.post(f"{url}?key={api_key}", json=payload, headers=headers)
-        if response.status_code == 200:
-            result = response.json()
-            candidates = result.get("candidates", [])
-            print(f"[DEBUG] API Response: {response.json()}")
-
-            if candidates:
-                mcqs_text = candidates[0]["content"]["parts"][0]["text"]
-                print(f"[DEBUG] Raw mcqs_text: {repr(mcqs_text)[:500]}...")  # Log raw text for inspection
-                print(f"[DEBUG] crew ai mcqs_text: {mcqs_text[:500]}...")  # Truncated for readability
-                parsed_mcqs = parse_mcqs(mcqs_text)
-                print(f"[DEBUG] Parsed MCQs: {parsed_mcqs}")
-                return parsed_mcqs
-
-        print(f"[ERROR] API Error: {response.text}")
-        return []
+        mcqs_text = get_llm_client().generate(
+            f"Create 5 MCQ questions with four options each and the correct answer. "
+            f"The questions should be based on the following content: {content}"
+        )
+        logger.debug("Raw mcqs_text: %s...", repr(mcqs_text)[:500])  # Log raw text for inspection
+        parsed_mcqs = parse_mcqs(mcqs_text)
+        logger.debug("Parsed MCQs: %s", parsed_mcqs)
+        return parsed_mcqs
 
     except Exception as e:
-        print(f"[ERROR] Failed to call Gemini API: {e}")
+        logger.error("Failed to call Gemini API: %s", e)
         return []
 
 def parse_mcqs(text):
+    with span("mcq_parse"):
+        return _parse_mcqs(text)
+
+def _parse_mcqs(text):
     try:
         mcqs = []
         text = re.sub(r'\n\s*\n+', '\n\n', text.replace('\r\n', '\n').strip())
         
         blocks = re.split(r'\n\n(?=\*\*[0-5]\.)', text)
-        print(f"[DEBUG] Found {len(blocks)} question blocks")
+        logger.debug("Found %s question blocks", len(blocks))
         
         for i, block in enumerate(blocks):
             block = block.strip()
             if not block:
-                print(f"[DEBUG] Skipping block {i+1}: Empty block")
+                logger.debug("Skipping block %s: Empty block", i+1)
                 continue
                 
             lines = [line.strip() for line in block.split('\n') if line.strip()]
-            print(f"[DEBUG] Block {i+1} has {len(lines)} lines: {lines[:2]}...")
+            logger.debug("Block %s has %s lines: %s...", i+1, len(lines), lines[:2])
             
             if len(lines) >= 6:
                 question_line = lines[0].replace("**", "").strip()
@@ -225,15 +325,15 @@ def parse_mcqs(text):
                         "options": options,
                         "correct_answer": correct_answer
                     })
-                    print(f"[DEBUG] Parsed MCQ {i+1}: {mcqs[-1]}")
+                    logger.debug("Parsed MCQ %s: %s", i+1, mcqs[-1])
                 else:
-                    print(f"[DEBUG] Skipping block {i+1}: Invalid options ({len(options)}) or answer ({correct_answer})")
+                    logger.debug("Skipping block %s: Invalid options (%s) or answer (%s)", i+1, len(options), correct_answer)
             else:
-                print(f"[DEBUG] Skipping block {i+1}: Not enough lines ({len(lines)})")
+                logger.debug("Skipping block %s: Not enough lines (%s)", i+1, len(lines))
         
-        print(f"[DEBUG] Total parsed MCQs: {len(mcqs)}")
+        logger.debug("Total parsed MCQs: %s", len(mcqs))
         return mcqs
     
     except Exception as e:
-        print(f"[ERROR] Failed to parse MCQs: {e}")
+        logger.error("Failed to parse MCQs: %s", e)
         return []
\ No newline at end of file
@@ -0,0 +1,99 @@
+import argparse
+import json
+import random
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from config import Config
+from bulk_ingest import find_pdf_sources
+from utils.pdf_parser import PDF_BACKENDS, extract_page_layouts, import_pymupdf, read_pdf_source
+from instrumentation import configure_logging
+
+WORDS = (
+    "model data training results method network learning performance analysis approach "
+    "evaluation dataset proposed baseline experiments accuracy features layer attention "
+    "optimization gradient loss sample distribution inference parameters benchmark"
+).split()
+
+
+def generate_corpus(directory, papers=10, pages=20, seed=0, prefix="paper"):
+    """
+    Write a synthetic fixture corpus of text PDFs with section headings, so the
+    benchmark can run without real papers. Returns the directory.
+    """
+    pymupdf = import_pymupdf()
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for paper in range(papers):
+        document = pymupdf.open()
+        for page_number in range(1, pages + 1):
+            page = document.new_page()
+            page.insert_text((72, 72), f"{page_number}. Section {page_number}", fontsize=16)
+            body = " ".join(rng.choice(WORDS) for _ in range(450)) + "."
+            page.insert_textbox(pymupdf.Rect(72, 96, 540, 760), body, fontsize=10)
+        document.save(directory / f"{prefix}_{paper:03d}.pdf")
+        document.close()
+    return directory
+
+
+def _parse(source, backend, parallel):
+    path, member = source
+    if member is not None:
+        return extract_page_layouts(BytesIO(read_pdf_source(path, member)), backend=backend)
+    return extract_page_layouts(path, backend=backend, path=path if parallel else None)
+
+
+def benchmark(sources, backend, parallel=False):
+    """Parse every source with one backend and report pages/sec."""
+    # Untimed warm-up: imports, and worker start-up for parallel parsing
+    _parse(sources[0], backend, parallel)
+    started = time.perf_counter()
+    pages = headings = 0
+    for source in sources:
+        layouts = _parse(source, backend, parallel)
+        pages += len(layouts)
+        headings += sum(len(page.headings) for page in layouts)
+    elapsed = time.perf_counter() - started
+    return {
+        "backend": backend + ("-parallel" if parallel else ""),
+        "pdfs": len(sources),
+        "pages": pages,
+        "headings": headings,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare PDF extraction backends in pages/sec")
+    parser.add_argument("path", nargs="?", help="directory or .zip of PDFs (default: generate a synthetic corpus)")
+    parser.add_argument("--papers", type=int, default=10, help="PDFs in the generated corpus")
+    parser.add_argument("--pages", type=int, default=20, help="pages per generated PDF")
+    parser.add_argument("--backends", nargs="+", choices=sorted(PDF_BACKENDS), default=sorted(PDF_BACKENDS))
+    parser.add_argument(
+        "--workers", type=int, default=Config.PDF_PARSE_WORKERS,
+        help="also time page-range parallel PyMuPDF parsing with this many processes (1 disables)",
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    configure_logging()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        corpus = args.path or generate_corpus(scratch, args.papers, args.pages)
+        sources = find_pdf_sources(corpus)
+        results = [benchmark(sources, backend) for backend in args.backends]
+        if args.workers > 1 and "pymupdf" in args.backends:
+            Config.PDF_PARSE_WORKERS = args.workers
+            Config.PDF_PARALLEL_MIN_PAGES = 0
+            results.append(benchmark(sources, "pymupdf", parallel=True))
+
+    for result in results:
+        print(
+            f"{result['backend']:>18}: {result['pages']} pages in {result['seconds']}s "
+            f"({result['pages_per_sec']} pages/s, {result['headings']} headings)"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,400 @@
+import argparse
+import logging
+import math
+import psycopg2
+from config import Config
+from db import get_connection
+from instrumentation import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaError(Exception):
+    """Raised when the database has not been migrated to the schema this code needs."""
+
+CHUNKS_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS public.chunks (
+    id BIGSERIAL PRIMARY KEY,
+    paper_id BIGINT NOT NULL REFERENCES public.data(id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    page_start INTEGER,
+    page_end INTEGER,
+    char_start INTEGER,
+    char_end INTEGER,
+    embedding vector({Config.EMBEDDING_DIM}) NOT NULL
+);
+ALTER TABLE public.chunks ADD COLUMN IF NOT EXISTS section TEXT;
+CREATE INDEX IF NOT EXISTS chunks_paper_id_idx ON public.chunks (paper_id);
+"""
+
+# Stemmed full-text vector of each chunk for the lexical half of hybrid retrieval.
+# Adding the generated column rewrites an existing chunks table once.
+CHUNKS_FTS_DDL = f"""
+ALTER TABLE public.chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('{Config.FTS_LANGUAGE}', content)) STORED;
+CREATE INDEX IF NOT EXISTS chunks_content_tsv_idx ON public.chunks USING gin (content_tsv);
+"""
+
+# The papers table predates this module; created here for fresh (e.g. benchmark) databases
+DATA_TABLE_DDL = f"""
+CREATE EXTENSION IF NOT EXISTS vector;
+CREATE TABLE IF NOT EXISTS public.data (
+    id BIGSERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    content TEXT,
+    embedding vector({Config.EMBEDDING_DIM}),
+    filestorage BYTEA
+);
+"""
+
+DATA_COLUMNS_DDL = """
+ALTER TABLE public.data ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE public.data ADD COLUMN IF NOT EXISTS file_sha256 TEXT;
+ALTER TABLE public.data ALTER COLUMN filestorage DROP NOT NULL;
+"""
+
+# Re-ingestion upserts papers by title and chunks by (paper_id, chunk_index).
+# The unique indexes are only created by migrate(), after remove_duplicates().
+UNIQUE_KEYS_DDL = """
+ALTER TABLE public.chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS data_title_key ON public.data (title);
+DROP INDEX IF EXISTS public.data_title_idx;
+CREATE UNIQUE INDEX IF NOT EXISTS chunks_paper_chunk_key ON public.chunks (paper_id, chunk_index);
+"""
+
+QUERY_CACHE_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS public.query_cache (
+    id BIGSERIAL PRIMARY KEY,
+    query TEXT NOT NULL,
+    embedding vector({Config.EMBEDDING_DIM}) NOT NULL,
+    chunk_ids BIGINT[] NOT NULL,
+    paper_hashes JSONB NOT NULL,
+    answer TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS query_cache_embedding_hnsw_idx
+    ON public.query_cache USING hnsw (embedding vector_cosine_ops);
+CREATE INDEX IF NOT EXISTS query_cache_created_at_idx ON public.query_cache (created_at);
+"""
+
+# PDFs are already compressed: EXTERNAL storage skips pointless compression
+# and lets substring() read a download chunk without detoasting the whole blob
+PDF_BLOBS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS public.pdf_blobs (
+    sha256 TEXT PRIMARY KEY,
+    size BIGINT NOT NULL,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE public.pdf_blobs ALTER COLUMN data SET STORAGE EXTERNAL;
+"""
+
+LLM_CACHE_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS public.llm_cache (
+    content_hash TEXT NOT NULL,
+    task_type TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    result JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (content_hash, task_type, prompt_version, model)
+);
+"""
+
+# State of background ingestion jobs, shared by all server processes
+JOBS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS public.jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    stages JSONB NOT NULL,
+    details JSONB NOT NULL,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+"""
+
+# Tables with an embedding column searched with the cosine distance operator
+VECTOR_TABLES = ("chunks", "data")
+
+# Per-query search settings for each recall/latency trade-off
+SEARCH_PROFILES = {
+    "fast": {"hnsw.ef_search": 20, "ivfflat.probes": 1},
+    "balanced": {"hnsw.ef_search": 40, "ivfflat.probes": 10},
+    "accurate": {"hnsw.ef_search": 100, "ivfflat.probes": 40},
+}
+
+# Tables and indexes created by migrate() that the code cannot work without
+REQUIRED_RELATIONS = (
+    "public.chunks",
+    "public.chunks_content_tsv_idx",
+    "public.data_title_key",
+    "public.chunks_paper_chunk_key",
+    "public.llm_cache",
+    "public.pdf_blobs",
+    "public.query_cache",
+    "public.query_cache_created_at_idx",
+    "public.jobs",
+)
+
+_schema_ready = False
+
+
+def vector_index_name(table, method):
+    return f"{table}_embedding_{method}_idx"
+
+
+def ensure_schema(conn):
+    """
+    Check, once per process, that migrate() has created everything this code
+    relies on, and raise SchemaError otherwise. Request paths never run DDL:
+    ALTER TABLE and CREATE INDEX take exclusive locks even when there is
+    nothing to change.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL",
+            (list(REQUIRED_RELATIONS),)
+        )
+        missing = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    if missing:
+        raise SchemaError(f"Database schema is out of date ({', '.join(missing)} missing); run: python schema.py migrate")
+    _schema_ready = True
+
+
+def _ivfflat_lists(cur, table):
+    """Number of IVFFlat lists: configured, or rows/1000 up to 1M rows and sqrt(rows) above."""
+    if Config.IVFFLAT_LISTS:
+        return Config.IVFFLAT_LISTS
+    cur.execute(f"SELECT count(*) FROM public.{table}")
+    rows = cur.fetchone()[0]
+    return max(1, rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows)))
+
+
+def _create_index_sql(table, method, lists=None, concurrently=False):
+    name = vector_index_name(table, method)
+    concurrently = "CONCURRENTLY " if concurrently else ""
+    if method == "hnsw":
+        options = f"m = {Config.HNSW_M}, ef_construction = {Config.HNSW_EF_CONSTRUCTION}"
+    elif method == "ivfflat":
+        options = f"lists = {lists}"
+    else:
+        raise ValueError(f"Unknown vector index method '{method}'")
+    return (
+        f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON public.{table} "
+        f"USING {method} (embedding vector_cosine_ops) WITH ({options})"
+    )
+
+
+def _drop_invalid_index(cur, name, concurrently=False):
+    """
+    Drop index name if it exists but is marked invalid, as a failed CREATE
+    INDEX CONCURRENTLY leaves it. IF NOT EXISTS would otherwise keep it forever.
+    """
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (f"public.{name}",))
+    row = cur.fetchone()
+    if row and not row[0]:
+        logger.warning("Dropping invalid index %s", name)
+        cur.execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS public.{name}")
+
+
+def create_vector_index(table, method=None, concurrently=True):
+    """
+    Build the ANN index for a table's embedding column if it does not exist,
+    replacing an invalid one left by an earlier failed build. Runs outside a
+    transaction so the index can be built concurrently.
+    """
+    method = method or Config.VECTOR_INDEX_METHOD
+    name = vector_index_name(table, method)
+    with get_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                _drop_invalid_index(cur, name, concurrently)
+                cur.execute("SET maintenance_work_mem = %s", (Config.INDEX_MAINTENANCE_WORK_MEM,))
+                try:
+                    lists = _ivfflat_lists(cur, table) if method == "ivfflat" else None
+                    logger.info("Building %s index on %s%s", method, table, f" with {lists} lists" if lists else "")
+                    cur.execute(_create_index_sql(table, method, lists, concurrently))
+                except psycopg2.Error:
+                    _drop_invalid_index(cur, name, concurrently)
+                    raise
+                finally:
+                    cur.execute("RESET maintenance_work_mem")
+        finally:
+            conn.autocommit = False
+
+
+def drop_vector_indexes(table):
+    """Drop every ANN index on a table, e.g. before a bulk load."""
+    with get_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for method in ("hnsw", "ivfflat"):
+                    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{vector_index_name(table, method)}")
+        finally:
+            conn.autocommit = False
+
+
+def rebuild_vector_index(table, method=None):
+    """
+    Drop and rebuild a table's ANN index. Use after bulk loads: building once
+    over the loaded rows is much faster than maintaining the index per insert,
+    and IVFFlat lists are only well placed when trained on the full data.
+    """
+    drop_vector_indexes(table)
+    create_vector_index(table, method)
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"ANALYZE public.{table}")
+        conn.commit()
+
+
+def remove_duplicates(cur):
+    """
+    Delete papers stored more than once under the same title, and chunks
+    stored more than once at the same position. Of each group the row with the
+    highest id, i.e. the last one inserted, is kept; reads used to take an
+    arbitrary row, so there is no earlier rule to preserve. Deleted papers take
+    their chunks with them. Every deleted paper is logged. Returns the number
+    of deleted (papers, chunks).
+    """
+    cur.execute(
+        """
+        DELETE FROM public.data d USING public.data newer
+        WHERE newer.title = d.title AND newer.id > d.id
+        RETURNING d.id, d.title, newer.id
+        """
+    )
+    papers = cur.fetchall()
+    for paper_id, title, kept_id in papers:
+        logger.warning("Deleted duplicate paper '%s' (id=%s), keeping id=%s", title, paper_id, kept_id)
+    cur.execute(
+        """
+        DELETE FROM public.chunks c USING public.chunks newer
+        WHERE newer.paper_id = c.paper_id AND newer.chunk_index = c.chunk_index AND newer.id > c.id
+        """
+    )
+    chunks = cur.rowcount
+    if chunks:
+        logger.warning("Deleted %s duplicate chunks", chunks)
+    return len(papers), chunks
+
+
+def migrate():
+    """
+    Bring the database up to the schema this code needs: new columns and
+    tables, duplicate papers and chunks removed before the unique keys that
+    re-ingestion upserts on, the full-text index and the configured ANN index
+    on every vector table. Takes exclusive table locks, so run it at deploy
+    time rather than under traffic.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(DATA_TABLE_DDL)
+            cur.execute(DATA_COLUMNS_DDL)
+            cur.execute(CHUNKS_TABLE_DDL)
+            papers, chunks = remove_duplicates(cur)
+            cur.execute(UNIQUE_KEYS_DDL)
+            cur.execute(CHUNKS_FTS_DDL)
+            cur.execute(LLM_CACHE_TABLE_DDL)
+            cur.execute(PDF_BLOBS_TABLE_DDL)
+            cur.execute(QUERY_CACHE_TABLE_DDL)
+            cur.execute(JOBS_TABLE_DDL)
+        conn.commit()
+        logger.info("Removed %s duplicate papers and %s duplicate chunks", papers, chunks)
+    for table in VECTOR_TABLES:
+        create_vector_index(table)
+
+
+def migrate_pdf_blobs(batch_size=100):
+    """
+    Move PDFs still stored inline in data.filestorage into pdf_blobs, in
+    batches, deduplicating identical files by SHA-256.
+    """
+    moved = 0
+    while True:
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            cur.execute(
+                """
+                WITH moved AS (
+                    SELECT id, filestorage, encode(sha256(filestorage), 'hex') AS sha256
+                    FROM public.data
+                    WHERE file_sha256 IS NULL AND filestorage IS NOT NULL
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ), blobs AS (
+                    INSERT INTO public.pdf_blobs (sha256, size, data)
+                    SELECT DISTINCT ON (sha256) sha256, octet_length(filestorage), filestorage FROM moved
+                    ON CONFLICT (sha256) DO NOTHING
+                )
+                UPDATE public.data d
+                SET file_sha256 = m.sha256, filestorage = NULL
+                FROM moved m
+                WHERE d.id = m.id
+                """,
+                (batch_size,)
+            )
+            conn.commit()
+            if cur.rowcount == 0:
+                break
+            moved += cur.rowcount
+            logger.info("Moved %s PDFs to pdf_blobs", moved)
+    logger.info("PDF blob migration finished; run VACUUM public.data to reclaim the freed space")
+    return moved
+
+
+def apply_search_params(cur, k, recall=None, table="chunks"):
+    """
+    Set the ANN search parameters for the current transaction from the
+    recall/latency profile, for the kind of index table actually has (read
+    from pg_am in the same statement, so an index rebuilt with another method
+    than VECTOR_INDEX_METHOD is still tuned). ef_search is never below k,
+    otherwise HNSW returns fewer than k rows.
+    """
+    profile = SEARCH_PROFILES[recall or Config.VECTOR_SEARCH_RECALL]
+    cur.execute(
+        """
+        SELECT set_config(s.setting, s.value, true)
+        FROM (VALUES ('hnsw', 'hnsw.ef_search', %s), ('ivfflat', 'ivfflat.probes', %s)) AS s(method, setting, value)
+        WHERE s.method IN (
+            SELECT am.amname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE i.indrelid = to_regclass(%s) AND i.indisvalid
+        )
+        """,
+        (str(max(profile["hnsw.ef_search"], k)), str(profile["ivfflat.probes"]), f"public.{table}")
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database schema and vector index management")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="create tables and vector indexes")
+    subparsers.add_parser("migrate-blobs", help="move inline PDFs from data into pdf_blobs")
+    for command in ("rebuild-index", "drop-index"):
+        sub = subparsers.add_parser(command)
+        sub.add_argument("--table", choices=VECTOR_TABLES, default="chunks")
+        if command == "rebuild-index":
+            sub.add_argument("--method", choices=("hnsw", "ivfflat"), default=None)
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.command == "migrate":
+        migrate()
+    elif args.command == "migrate-blobs":
+        migrate_pdf_blobs()
+    elif args.command == "rebuild-index":
+        rebuild_vector_index(args.table, args.method)
+    else:
+        drop_vector_indexes(args.table)
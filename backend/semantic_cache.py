@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from psycopg2.extras import Json
+from config import Config
+from db import get_connection
+from schema import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Chatbot answer cache keyed by query meaning rather than query text.
+
+    A lookup is a hit when a cached query embedding is within
+    `threshold` cosine similarity of the new one and every paper the answer was
+    built from still has the content hash it had at the time. The in-process
+    tier is an LRU with TTL; misses fall through to the persistent
+    query_cache table, searched with pgvector.
+    """
+
+    def __init__(self, threshold, ttl, max_entries):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_key = 0
+        self._stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "stale": 0, "stores": 0}
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _remember(self, embedding, answer, paper_hashes):
+        with self._lock:
+            self._entries[self._next_key] = (embedding, answer, paper_hashes, time.time())
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _memory_lookup(self, embedding):
+        """Best unexpired in-process match above the threshold, as (key, entry)."""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if now - entry[3] > self.ttl]:
+                del self._entries[key]
+            if not self._entries:
+                return None
+            keys = list(self._entries)
+            similarities = np.stack([self._entries[k][0] for k in keys]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            key = keys[best]
+            self._entries.move_to_end(key)
+            return key, self._entries[key]
+
+    def _persistent_lookup(self, embedding):
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            cur.execute(
+                """
+                SELECT answer, paper_hashes
+                FROM public.query_cache
+                WHERE created_at > now() - make_interval(secs => %s)
+                  AND embedding <=> %s <= %s
+                ORDER BY embedding <=> %s
+                LIMIT 1
+                """,
+                (self.ttl, embedding, 1 - self.threshold, embedding)
+            )
+            return cur.fetchone()
+
+    def _persistent_lookup_batch(self, embeddings):
+        """Best persistent match for each embedding, as {index: (answer, paper_hashes)}."""
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            cur.execute(
+                """
+                SELECT q.position, c.answer, c.paper_hashes
+                FROM unnest(%s::vector[]) WITH ORDINALITY AS q(embedding, position)
+                CROSS JOIN LATERAL (
+                    SELECT answer, paper_hashes
+                    FROM public.query_cache
+                    WHERE created_at > now() - make_interval(secs => %s)
+                      AND embedding <=> q.embedding <= %s
+                    ORDER BY embedding <=> q.embedding
+                    LIMIT 1
+                ) c
+                """,
+                (list(embeddings), self.ttl, 1 - self.threshold)
+            )
+            return {position - 1: (answer, paper_hashes) for position, answer, paper_hashes in cur.fetchall()}
+
+    @staticmethod
+    def _current_hashes(paper_ids):
+        """Current content hash of each of the given papers, keyed by id as a string."""
+        if not paper_ids:
+            return {}
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, content_hash FROM public.data WHERE id = ANY(%s)",
+                ([int(paper_id) for paper_id in paper_ids],)
+            )
+            return {str(row[0]): row[1] for row in cur.fetchall()}
+
+    @staticmethod
+    def _unchanged(paper_hashes, current):
+        # An answer built from no papers could be outdated by any new upload;
+        # such answers are no longer stored, and older ones count as stale
+        if not paper_hashes:
+            return False
+        return all(
+            paper_id in current and current[paper_id] == content_hash
+            for paper_id, content_hash in paper_hashes.items()
+        )
+
+    def _papers_unchanged(self, paper_hashes):
+        return self._unchanged(paper_hashes, self._current_hashes(paper_hashes))
+
+    def lookup(self, query_embedding):
+        """Return a cached answer for a semantically equivalent query, or None."""
+        embedding = self._normalize(query_embedding)
+        try:
+            match = self._memory_lookup(embedding)
+            if match:
+                key, (_, answer, paper_hashes, _) = match
+                if self._papers_unchanged(paper_hashes):
+                    self._count("memory_hits")
+                    return answer
+                with self._lock:
+                    self._entries.pop(key, None)
+                self._count("stale")
+
+            row = self._persistent_lookup(embedding)
+            if row:
+                answer, paper_hashes = row
+                if self._papers_unchanged(paper_hashes):
+                    self._remember(embedding, answer, paper_hashes)
+                    self._count("persistent_hits")
+                    return answer
+                self._count("stale")
+        except Exception as e:
+            logger.error("Semantic cache lookup failed: %s", e)
+
+        self._count("misses")
+        return None
+
+    def lookup_batch(self, query_embeddings):
+        """
+        lookup for many queries at once. The persistent tier is searched for
+        all in-process misses in one statement, and the papers behind every
+        candidate answer are checked in one more. Returns one answer or None
+        per query, in order.
+        """
+        embeddings = [self._normalize(embedding) for embedding in query_embeddings]
+        answers = [None] * len(embeddings)
+        try:
+            candidates = {}
+            for i, embedding in enumerate(embeddings):
+                match = self._memory_lookup(embedding)
+                if match:
+                    key, (_, answer, paper_hashes, _) = match
+                    candidates[i] = (key, answer, paper_hashes)
+
+            misses = [i for i in range(len(embeddings)) if i not in candidates]
+            if misses:
+                rows = self._persistent_lookup_batch([embeddings[i] for i in misses])
+                for index, (answer, paper_hashes) in rows.items():
+                    candidates[misses[index]] = (None, answer, paper_hashes)
+
+            current = self._current_hashes({
+                paper_id for _, _, paper_hashes in candidates.values() for paper_id in paper_hashes or ()
+            })
+            for i, (key, answer, paper_hashes) in candidates.items():
+                if not self._unchanged(paper_hashes, current):
+                    if key is not None:
+                        with self._lock:
+                            self._entries.pop(key, None)
+                    self._count("stale")
+                    continue
+                if key is None:
+                    self._remember(embeddings[i], answer, paper_hashes)
+                self._count("memory_hits" if key is not None else "persistent_hits")
+                answers[i] = answer
+        except Exception as e:
+            logger.error("Semantic cache batch lookup failed: %s", e)
+            answers = [None] * len(embeddings)
+
+        for answer in answers:
+            if answer is None:
+                self._count("misses")
+        return answers
+
+    def store(self, query, query_embedding, documents, answer):
+        """
+        Cache an answer with the chunks and paper versions it was built from.
+        Answers given without any retrieved chunks are not cached. Entries past
+        the TTL are deleted from query_cache on every store.
+        """
+        if not documents:
+            return
+        embedding = self._normalize(query_embedding)
+        paper_hashes = {
+            str(doc.metadata["paper_id"]): doc.metadata.get("content_hash") for doc in documents
+        }
+        chunk_ids = [doc.metadata["chunk_id"] for doc in documents]
+        self._remember(embedding, answer, paper_hashes)
+        try:
+            with get_connection() as conn, conn.cursor() as cur:
+                ensure_schema(conn)
+                cur.execute(
+                    """
+                    INSERT INTO public.query_cache (query, embedding, chunk_ids, paper_hashes, answer)
+                    VALUES (%s, %s, %s, %s, %s)
+                    """,
+                    (query, embedding, chunk_ids, Json(paper_hashes), answer)
+                )
+                cur.execute(
+                    "DELETE FROM public.query_cache WHERE created_at <= now() - make_interval(secs => %s)",
+                    (self.ttl,)
+                )
+                conn.commit()
+            self._count("stores")
+        except Exception as e:
+            logger.error("Semantic cache store failed: %s", e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["persistent_hits"] + self._stats["misses"]
+            hits = lookups - self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the process-wide semantic cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache(
+                    Config.SEMANTIC_CACHE_THRESHOLD,
+                    Config.SEMANTIC_CACHE_TTL,
+                    Config.SEMANTIC_CACHE_MAX_ENTRIES,
+                )
+    return _cache
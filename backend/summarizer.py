@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from config import Config
+from cache import cached_result
+from llm_client import get_llm_client, LLMError
+from model import GEMINI_MODEL, summary_prompt
+
+logger = logging.getLogger(__name__)
+
+# Bump when the section / reduce prompts change so cached section summaries are regenerated
+SECTION_SUMMARY_PROMPT_VERSION = "1"
+
+# Reduce rounds allowed before the combined partial summaries are used as they are
+MAX_REDUCE_DEPTH = 3
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Shared pool bounding concurrent section summary calls across all requests."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=Config.SUMMARY_MAX_WORKERS, thread_name_prefix="summary"
+                )
+    return _executor
+
+
+def section_prompt(section):
+    return (
+        "Summarize this section of a research paper in a short paragraph. "
+        "Keep key methods, results and numbers:\n\n"
+        f"{section}"
+    )
+
+
+def reduce_prompt(partial_summaries):
+    return (
+        "The following are summaries of consecutive sections of one research paper. "
+        "Combine them into a single short summary of the whole paper:\n\n"
+        f"{partial_summaries}"
+    )
+
+
+def split_sections(content, max_chars=Config.SUMMARY_SECTION_CHARS) -> List[str]:
+    """
+    Split text into sections of at most max_chars, preferring paragraph and then
+    line boundaries in the second half of each window.
+    """
+    sections = []
+    start = 0
+    while start < len(content):
+        end = min(start + max_chars, len(content))
+        if end < len(content):
+            for separator in ("\n\n", "\n", " "):
+                cut = content.rfind(separator, start + max_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        section = content[start:end].strip()
+        if section:
+            sections.append(section)
+        start = end
+    return sections
+
+
+def _summarize_section(section):
+    section_hash = hashlib.sha256(section.encode("utf-8")).hexdigest()
+
+    def generate():
+        summary = get_llm_client().generate(section_prompt(section))
+        if not summary:
+            raise LLMError("Gemini returned an empty section summary")
+        return summary
+
+    return cached_result(section_hash, "section_summary", SECTION_SUMMARY_PROMPT_VERSION, GEMINI_MODEL, generate)
+
+
+def summarize_sections(sections) -> List[str]:
+    """
+    Summarize sections concurrently on the shared pool, in section order.
+    Summaries are cached by section hash. Raises if any section fails, so an
+    incomplete set of sections is never summarized (and cached) as the whole.
+    """
+    return list(_get_executor().map(_summarize_section, sections))
+
+
+def condensed_content(content):
+    """
+    Content short enough for a single prompt: the content itself, or the joined
+    section summaries of a long paper (shared with summarization through the cache).
+    """
+    if len(content) <= Config.SUMMARY_SECTION_CHARS:
+        return content
+    return "\n\n".join(summarize_sections(split_sections(content)))
+
+
+def final_summary_prompt(content):
+    """
+    Prompt for the final summary of a paper. Short papers are summarized in a
+    single pass; long ones are mapped to section summaries, reduced
+    hierarchically until they fit in one prompt, and combined.
+    """
+    if len(content) <= Config.SUMMARY_SECTION_CHARS:
+        return summary_prompt(content)
+
+    combined = condensed_content(content)
+    for _ in range(MAX_REDUCE_DEPTH):
+        if len(combined) <= Config.SUMMARY_SECTION_CHARS:
+            break
+        combined = "\n\n".join(summarize_sections(split_sections(combined)))
+    return reduce_prompt(combined)
+
+
+def summarize_long_text(content):
+    """
+    Summarize content of any length with map-reduce summarization.
+    """
+    try:
+        return get_llm_client().generate(final_summary_prompt(content))
+    except Exception as e:
+        logger.error("Failed to call Gemini API: %s", e)
+        return ""
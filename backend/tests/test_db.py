@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("pgvector")
+
+import db
+from psycopg2 import extensions
+
+
+class FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = FakeInfo()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def connect(*args, **kwargs):
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(db.psycopg2, "connect", connect)
+    monkeypatch.setattr(db, "register_vector", lambda conn: None)
+    return opened
+
+
+def test_returned_connections_stay_open_up_to_maxconn(connections):
+    pool = db.ConnectionPool(1, 4)
+    checked_out = [pool.getconn() for _ in range(4)]
+    for conn in checked_out:
+        pool.putconn(conn)
+
+    assert not any(conn.closed for conn in connections)
+    again = [pool.getconn() for _ in range(4)]
+    assert len(connections) == 4
+    assert {id(conn) for conn in again} == {id(conn) for conn in checked_out}
+    for conn in again:
+        pool.putconn(conn)
+
+
+def test_closed_connections_are_forgotten(connections):
+    pool = db.ConnectionPool(1, 2)
+    conn = pool.getconn()
+    pool.putconn(conn, close=True)
+    assert conn.closed
+    assert pool._last_used == {}
+
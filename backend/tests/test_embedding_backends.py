@@ -0,0 +1,38 @@
+import pytest
+
+for module in ("torch", "transformers", "sentence_transformers", "onnx", "onnxruntime"):
+    pytest.importorskip(module)
+
+from config import Config
+from embedding_check import MIN_COSINE, compare_backends
+from utils.embedding_backends import export_onnx
+
+TEXTS = [
+    "the model encodes each token",
+    "short text",
+    "a longer text pads the shorter ones in the batch so the attention mask matters",
+    "padded tokens must not change the embedding",
+]
+
+
+@pytest.fixture
+def tiny_model(tmp_path, monkeypatch):
+    """A small randomly initialised BERT saved locally, so no model is downloaded."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    words = sorted({word for text in TEXTS for word in text.split()})
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words) + "\n")
+    model_dir = tmp_path / "model"
+    BertTokenizerFast(vocab_file=str(vocab)).save_pretrained(model_dir)
+    BertModel(BertConfig(
+        vocab_size=5 + len(words), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64
+    )).save_pretrained(model_dir)
+    monkeypatch.setattr(Config, "EMBEDDING_MODEL_NAME", str(model_dir))
+    return str(model_dir)
+
+
+def test_onnx_export_matches_torch(tiny_model, tmp_path):
+    model_path = export_onnx(tiny_model, str(tmp_path / "model.onnx"))
+    report = compare_backends(TEXTS, "onnx", model_path=model_path, batch_size=len(TEXTS))
+    assert report["cosine_min"] >= MIN_COSINE
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("psycopg2")
+pgvector = pytest.importorskip("pgvector")
+
+import ingest
+import vector_db
+from config import Config
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+def test_reingest_reuses_stored_embeddings(monkeypatch):
+    stored = np.random.default_rng(0).random(Config.EMBEDDING_DIM, dtype=np.float32)
+    new = np.random.default_rng(1).random(Config.EMBEDDING_DIM, dtype=np.float32)
+
+    @contextmanager
+    def fake_connection():
+        # register_vector returns vector columns as pgvector.Vector objects
+        yield FakeConnection([("stored-hash", pgvector.Vector(stored))])
+
+    encoded = []
+
+    def fake_encode(texts):
+        encoded.extend(texts)
+        return np.asarray([new for _ in texts])
+
+    monkeypatch.setattr(vector_db, "get_connection", fake_connection)
+    monkeypatch.setattr(vector_db, "ensure_schema", lambda conn: None)
+    monkeypatch.setattr(ingest, "generate_embeddings_batch", fake_encode)
+
+    chunks = [
+        {"content_hash": "stored-hash", "content": "unchanged text"},
+        {"content_hash": "new-hash", "content": "new text"},
+    ]
+    embeddings = ingest.embed_new_chunks(["paper"], [chunks])[0]
+
+    assert encoded == ["new text"]
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (2, Config.EMBEDDING_DIM)
+    np.testing.assert_array_equal(embeddings[0], stored)
+    np.testing.assert_array_equal(embeddings[1], new)
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from instrumentation import observe_first_chunk
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_streamed_body_is_observed_at_its_first_chunk():
+    events = []
+
+    def body():
+        events.append("started")
+        yield b"first"
+        yield b"second"
+
+    chunks = observe_first_chunk(body(), lambda: events.append("observed"))
+    assert events == []
+    assert next(chunks) == b"first"
+    assert events == ["started", "observed"]
+    assert list(chunks) == [b"second"]
+    assert events == ["started", "observed"]
+
+
+def test_empty_or_closed_body_is_still_observed():
+    observed = []
+    assert list(observe_first_chunk(iter(()), lambda: observed.append(True))) == []
+    assert observed == [True]
+
+    closed = []
+
+    class Body:
+        def __iter__(self):
+            yield b"chunk"
+
+        def close(self):
+            closed.append(True)
+
+    chunks = observe_first_chunk(Body(), lambda: None)
+    next(chunks)
+    chunks.close()
+    assert closed == [True]
+
+
+def test_metrics_are_aggregated_across_worker_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    worker = "from instrumentation import span\nwith span('embed'):\n    pass\n"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker], cwd=BACKEND, env=env, check=True)
+
+    render = "import sys\nfrom instrumentation import render_metrics\nsys.stdout.write(render_metrics().decode())\n"
+    output = subprocess.run(
+        [sys.executable, "-c", render], cwd=BACKEND, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    assert 'paper_stage_duration_seconds_count{outcome="ok",stage="embed"} 2.0' in output
@@ -0,0 +1,46 @@
+import os
+import signal
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+
+from config import Config
+from utils import pdf_parser
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    document = pymupdf.open()
+    for number in range(1, 5):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Section {number}", fontsize=20)
+        page.insert_text((72, 120), f"Body text of page {number} in the usual size.", fontsize=10)
+    path = str(tmp_path / "paper.pdf")
+    document.save(path)
+    document.close()
+    return path
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    monkeypatch.setattr(Config, "PDF_PARSE_WORKERS", 2)
+    monkeypatch.setattr(Config, "PDF_PARALLEL_MIN_PAGES", 2)
+    yield
+    if pdf_parser._executor is not None:
+        pdf_parser._executor.shutdown()
+        pdf_parser._executor = None
+
+
+def test_parallel_parse_recovers_from_dead_worker(pdf_path, parallel):
+    first = pdf_parser.extract_page_layouts(None, backend="pymupdf", path=pdf_path)
+    assert [page.headings[0][1] for page in first] == ["Section 1", "Section 2", "Section 3", "Section 4"]
+
+    broken = pdf_parser._executor
+    os.kill(next(iter(broken._processes)), signal.SIGKILL)
+    # Let the pool notice the dead worker before the next submit
+    for process in list(broken._processes.values()):
+        process.join(timeout=10)
+
+    second = pdf_parser.extract_page_layouts(None, backend="pymupdf", path=pdf_path)
+    assert second == first
+    assert pdf_parser._executor is not broken
@@ -0,0 +1,88 @@
+import bisect
+import hashlib
+from typing import Dict, List, Optional, Sequence
+from config import Config
+from utils.embeddings import get_embedding_model
+
+def _token_offsets(text: str) -> List[tuple]:
+    """
+    Return the (start, end) character offsets of each model token in text.
+    """
+    if not text:
+        return []
+    encoding = get_embedding_model().tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False,
+    )
+    return encoding["offset_mapping"]
+
+def _section(heading_positions: List[tuple], char_start: int, char_end: int) -> Optional[str]:
+    """
+    The heading a chunk belongs to: the last one at or before its start, else
+    the first one inside it.
+    """
+    index = bisect.bisect_right(heading_positions, (char_start, chr(0x10FFFF)))
+    if index:
+        return heading_positions[index - 1][1]
+    if heading_positions and heading_positions[0][0] < char_end:
+        return heading_positions[0][1]
+    return None
+
+def chunk_pages(
+    pages: Sequence[str],
+    max_tokens: int = Config.CHUNK_MAX_TOKENS,
+    overlap: int = Config.CHUNK_OVERLAP_TOKENS,
+    headings: Optional[Sequence[Sequence[tuple]]] = None,
+) -> List[Dict]:
+    """
+    Split the pages of a paper into overlapping windows of at most max_tokens
+    embedding-model tokens, so no chunk is truncated by the encoder.
+    Args:
+        pages (Sequence[str]): Text of each page, in page order.
+        max_tokens (int): Maximum number of tokens per chunk.
+        overlap (int): Number of tokens shared by consecutive chunks.
+        headings (Sequence[Sequence[tuple]]): Optional (offset, heading) pairs
+            found on each page, as produced by the PDF parser.
+    Returns:
+        List[Dict]: Chunks with their content and its SHA-256, 1-based page
+        range, character offsets into the pages joined with "\\n" and section
+        heading (or None).
+    """
+    if overlap < 0 or overlap >= max_tokens:
+        raise ValueError("overlap must be non-negative and smaller than max_tokens")
+
+    full_text = "\n".join(pages)
+    page_starts = []
+    spans = []
+    offset = 0
+    heading_positions = []
+    for page_index, page_text in enumerate(pages):
+        page_starts.append(offset)
+        if headings:
+            heading_positions.extend((offset + start, heading) for start, heading in headings[page_index])
+        spans.extend((offset + start, offset + end) for start, end in _token_offsets(page_text))
+        offset += len(page_text) + 1
+
+    chunks = []
+    stride = max_tokens - overlap
+    for start in range(0, len(spans), stride):
+        window = spans[start:start + max_tokens]
+        char_start, char_end = window[0][0], window[-1][1]
+        content = full_text[char_start:char_end].strip()
+        if content:
+            chunks.append({
+                "chunk_index": len(chunks),
+                "content": content,
+                "content_hash": hashlib.sha256(content.encode("utf-8")).hexdigest(),
+                "page_start": bisect.bisect_right(page_starts, char_start),
+                "page_end": bisect.bisect_right(page_starts, char_end - 1),
+                "char_start": char_start,
+                "char_end": char_end,
+                "section": _section(heading_positions, char_start, char_end),
+            })
+        if start + max_tokens >= len(spans):
+            break
+
+    return chunks
@@ -0,0 +1,122 @@
+import numpy as np
+from config import Config
+
+
+class SentenceTransformerBackend:
+    """
+    Reference PyTorch backend. With quantize=True the Linear layers are
+    dynamically quantized to int8, which is faster on CPU at a small accuracy cost.
+    """
+
+    def __init__(self, model_name, quantize=False):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu" if quantize else None)
+        if quantize:
+            import torch
+
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        kwargs.setdefault("show_progress_bar", False)
+        return np.asarray(self.model.encode(texts, batch_size=batch_size, **kwargs), dtype=np.float32)
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime backend for an exported (optionally int8-quantized) copy of
+    the model. Reproduces the sentence-transformers pipeline: mean pooling
+    over the attention mask followed by L2 normalisation.
+    """
+
+    def __init__(self, model_name, model_path, threads=0, max_seq_length=256):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(_hub_name(model_name))
+        self.max_seq_length = max_seq_length
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            outputs.append(pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None))
+        embeddings = np.concatenate(outputs).astype(np.float32) if outputs else np.empty((0, Config.EMBEDDING_DIM), np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def _hub_name(model_name):
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def load_embedding_backend(backend=None, model_name=None, model_path=None):
+    """Create the embedding backend selected in Config (or by the arguments)."""
+    backend = backend or Config.EMBEDDING_BACKEND
+    model_name = model_name or Config.EMBEDDING_MODEL_NAME
+    if backend == "torch":
+        return SentenceTransformerBackend(model_name)
+    if backend == "torch-int8":
+        return SentenceTransformerBackend(model_name, quantize=True)
+    if backend == "onnx":
+        return OnnxBackend(model_name, model_path or Config.EMBEDDING_MODEL_PATH, threads=Config.EMBEDDING_THREADS)
+    raise ValueError(f"Unknown embedding backend '{backend}'")
+
+
+def export_onnx(model_name, output_path, quantize=False):
+    """
+    Export the transformer of a sentence-transformers model to ONNX for
+    OnnxBackend, optionally quantizing its weights to int8.
+    """
+    import inspect
+    import os
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    hub_name = _hub_name(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    model = AutoModel.from_pretrained(hub_name).eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    # The tokenizer's key order (input_ids, token_type_ids, attention_mask) is
+    # not forward's argument order, so inputs are bound by name in forward's order
+    input_names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    fp32_path = output_path if not quantize else output_path + ".fp32"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            ({name: sample[name] for name in input_names},),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, output_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    return output_path
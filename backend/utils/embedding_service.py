@@ -0,0 +1,100 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+
+class MicroBatchEncoder:
+    """
+    Coalesces concurrent single-text encode requests into batched model calls.
+
+    Requests are queued to a background thread that waits up to `max_wait`
+    seconds after the first request (or until `max_batch` requests are queued)
+    and encodes the whole batch in one call. Results are float32 numpy arrays,
+    kept in an LRU cache keyed by the SHA-1 of the text. Returned arrays are
+    read-only because they are shared with the cache.
+    """
+
+    def __init__(self, encode_batch, max_batch=32, max_wait=0.005, cache_size=10000):
+        self._encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+        self._stats = {"requests": 0, "cache_hits": 0, "batches": 0, "batched_texts": 0}
+
+    def _ensure_worker(self):
+        # The worker thread does not survive fork(), so each process starts its own
+        if self._worker is None or self._pid != os.getpid():
+            with self._lock:
+                if self._worker is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._worker = threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True)
+                    self._worker.start()
+                    self._pid = os.getpid()
+
+    def encode(self, text, timeout=None):
+        """Return the embedding of text, batching with concurrent callers."""
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            self._stats["requests"] += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return cached
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        embedding = future.result(timeout)
+
+        with self._lock:
+            self._cache[key] = embedding
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return embedding
+
+    def _run(self, requests):
+        while True:
+            batch = [requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = np.asarray(self._encode_batch([text for text, _ in batch]), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["batched_texts"] += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                vector.setflags(write=False)
+                future.set_result(vector)
+
+    def stats(self):
+        with self._lock:
+            batches = self._stats["batches"]
+            return {
+                **self._stats,
+                "cache_entries": len(self._cache),
+                "avg_batch_size": round(self._stats["batched_texts"] / batches, 2) if batches else 0.0,
+            }
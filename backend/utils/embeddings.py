@@ -1,28 +1,75 @@
+import logging
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from typing import List
+from config import Config
+from instrumentation import span
+from utils.embedding_backends import load_embedding_backend
+from utils.embedding_service import MicroBatchEncoder
 
-# Load the model
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+logger = logging.getLogger(__name__)
 
-def generate_embeddings(text: str) -> List[float]:
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """
+    Return the embedding backend selected by EMBEDDING_BACKEND (torch, torch-int8
+    or onnx), loading it on first use so importing this module stays cheap.
     """
-    Generate embeddings for the given text using Sentence Transformers.
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = load_embedding_backend()
+    return _embedding_model
+
+
+def _encode_micro_batch(texts):
+    with span("embed"):
+        return get_embedding_model().encode(texts, batch_size=len(texts), show_progress_bar=False)
+
+# Concurrent single-text requests (chat queries) share forward passes
+embedding_service = MicroBatchEncoder(
+    _encode_micro_batch,
+    max_batch=Config.EMBEDDING_MAX_BATCH,
+    max_wait=Config.EMBEDDING_MAX_WAIT_MS / 1000,
+    cache_size=Config.EMBEDDING_CACHE_SIZE,
+)
+
+def generate_embeddings(text: str) -> np.ndarray:
+    """
+    Generate embeddings for the given text with the configured embedding backend.
     Args:
         text (str): The text to generate embeddings for.
     Returns:
-        List[float]: A list of embeddings (vector).
+        np.ndarray: Read-only float32 embedding vector.
     """
-    print(f"[DEBUG] generate_embeddings called with text length: {len(text)}")
-
     if not text.strip():
         raise ValueError("Text cannot be empty for embeddings generation.")
-    
-    # Generate embeddings
-    embeddings = embedding_model.encode(text).tolist()
-    print(f"[DEBUG] Generated embedding of length: {len(embeddings)}")
 
-    return embeddings
+    return embedding_service.encode(text)
+
+def generate_embeddings_batch(texts: List[str], batch_size: int = Config.EMBEDDING_BATCH_SIZE) -> np.ndarray:
+    """
+    Generate embeddings for many texts with batched encode calls.
+    Args:
+        texts (List[str]): The texts to generate embeddings for.
+        batch_size (int): Number of texts per forward pass.
+    Returns:
+        np.ndarray: float32 array with one embedding row per input text, in input order.
+    """
+    logger.debug("generate_embeddings_batch called with %s texts", len(texts))
+
+    if any(not text.strip() for text in texts):
+        raise ValueError("Text cannot be empty for embeddings generation.")
+    if not texts:
+        return np.empty((0, Config.EMBEDDING_DIM), dtype=np.float32)
+
+    with span("embed"):
+        embeddings = get_embedding_model().encode(texts, batch_size=batch_size, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
 
 # def generate_embeddings(text):
 #     """Generate embeddings for given text using SentenceTransformer."""
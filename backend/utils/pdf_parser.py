@@ -1,14 +1,266 @@
-import PyPDF2
+import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
 from io import BytesIO
+from typing import List
+from config import Config
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# One parsed page: 1-based page number, text, and the headings found on the
+# page as (character offset into text, heading text)
+PageLayout = namedtuple("PageLayout", ["number", "text", "headings"])
+
+def import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:  # PyMuPDF < 1.24.3 only provides the fitz name
+        import fitz as pymupdf
+    return pymupdf
+
+class PyMuPDFBackend:
+    """
+    MuPDF text extraction. Headings are short lines set noticeably larger than
+    the page's body text, or bold at body size or above.
+    """
+    name = "pymupdf"
+    heading_size_ratio = 1.15
+    max_heading_chars = 120
+
+    @staticmethod
+    def _open(source):
+        pymupdf = import_pymupdf()
+        if isinstance(source, (str, os.PathLike)):
+            return pymupdf.open(source)
+        # Callers pass a path whenever the PDF is on disk; only uploads that
+        # never touched the disk reach here, and MuPDF needs them as bytes
+        stream = source.getvalue() if isinstance(source, BytesIO) else bytes(source)
+        return pymupdf.open(stream=stream, filetype="pdf")
+
+    def page_count(self, source):
+        with self._open(source) as document:
+            return document.page_count
+
+    def iter_pages(self, source, start=0, stop=None):
+        with self._open(source) as document:
+            stop = document.page_count if stop is None else min(stop, document.page_count)
+            for index in range(start, stop):
+                yield self._page_layout(index + 1, document[index])
+
+    def _page_layout(self, number, page):
+        lines = []
+        for block in page.get_text("dict")["blocks"]:
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                spans = [span for span in line["spans"] if span["text"]]
+                if spans:
+                    lines.append((
+                        "".join(span["text"] for span in spans),
+                        max(span["size"] for span in spans),
+                        all(span["flags"] & 16 for span in spans),
+                    ))
+
+        sizes = Counter()
+        for text, size, _ in lines:
+            sizes[round(size, 1)] += len(text)
+        body_size = sizes.most_common(1)[0][0] if sizes else 0
+
+        headings = []
+        offset = 0
+        for text, size, bold in lines:
+            heading = text.strip()
+            if (
+                heading
+                and len(heading) <= self.max_heading_chars
+                and not heading.endswith(".")
+                and any(char.isalpha() for char in heading)
+                and (size >= body_size * self.heading_size_ratio or (bold and size >= body_size))
+            ):
+                headings.append((offset, heading))
+            offset += len(text) + 1
+        return PageLayout(number, "\n".join(text for text, _, _ in lines), headings)
+
+class PyPDF2Backend:
+    """Pure-Python fallback extraction: text only, without headings."""
+    name = "pypdf2"
+
+    def page_count(self, source):
+        import PyPDF2
+
+        return len(PyPDF2.PdfReader(source).pages)
+
+    def iter_pages(self, source, start=0, stop=None):
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(source)
+        stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+        for index in range(start, stop):
+            yield PageLayout(index + 1, reader.pages[index].extract_text() or "", [])
+
+PDF_BACKENDS = {backend.name: backend for backend in (PyMuPDFBackend, PyPDF2Backend)}
+
+def get_pdf_backend(name=None):
+    """
+    The extraction backend named by PDF_BACKEND (pymupdf or pypdf2), falling
+    back to PyPDF2 when PyMuPDF is not installed.
+    """
+    name = name or Config.PDF_BACKEND
+    if name == PyMuPDFBackend.name:
+        try:
+            import_pymupdf()
+        except ImportError:
+            logger.warning("PyMuPDF is not installed, falling back to PyPDF2")
+            name = PyPDF2Backend.name
+    return PDF_BACKENDS[name]()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """Shared spawn-based pool for page-range parsing of large PDFs."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=Config.PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _executor
+
+def _replace_executor(broken):
+    """
+    Discard a pool that lost a worker (killed for memory, or crashed on a
+    malformed PDF); the next _get_executor call starts a fresh one. Threads
+    that saw the same broken pool replace it only once.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def _parse_page_range(backend_name, path, start, stop):
+    return list(PDF_BACKENDS[backend_name]().iter_pages(path, start, stop))
+
+def _parse_parallel(backend, path, page_count):
+    """
+    Parse page ranges of a PDF on disk in worker processes, in page order.
+    If the pool is broken it is replaced and the parse retried once.
+    """
+    workers = Config.PDF_PARSE_WORKERS
+    size = -(-page_count // workers)
+    ranges = [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            futures = [executor.submit(_parse_page_range, backend.name, path, start, stop) for start, stop in ranges]
+            return [page for future in futures for page in future.result()]
+        except BrokenProcessPool:
+            _replace_executor(executor)
+            if attempt:
+                raise
+            logger.warning("PDF parse worker pool broke, restarting it and retrying")
+
+def extract_page_layouts(pdf_file, backend=None, path=None) -> List[PageLayout]:
+    """
+    Parse every page of a PDF with the configured backend. When the PDF is also
+    available on disk at path it is opened from there rather than from pdf_file,
+    and if it has at least PDF_PARALLEL_MIN_PAGES pages, page ranges are parsed
+    in parallel processes. Documents PyMuPDF cannot parse are retried with PyPDF2.
+    """
+    with span("pdf_parse"):
+        backend = get_pdf_backend(backend)
+        source = path or pdf_file
+        try:
+            if path and Config.PDF_PARSE_WORKERS > 1:
+                page_count = backend.page_count(path)
+                if page_count >= Config.PDF_PARALLEL_MIN_PAGES:
+                    return _parse_parallel(backend, path, page_count)
+            return list(backend.iter_pages(source))
+        except Exception as e:
+            if backend.name == PyPDF2Backend.name:
+                raise
+            logger.warning("%s failed to parse PDF (%s), retrying with PyPDF2", backend.name, e)
+            return list(PyPDF2Backend().iter_pages(source))
+
+@contextmanager
+def pdf_buffer(pdf_file):
+    """
+    Yield a seekable, read-only view of a PDF without copying it into memory.
+    Files on disk are memory-mapped, in-memory BytesIO uploads are used as they
+    are, and any other stream is spooled to a temporary file in fixed-size
+    blocks and mapped from there.
+    """
+    if isinstance(pdf_file, BytesIO):
+        pdf_file.seek(0)
+        yield pdf_file
+        return
+
+    try:
+        fileno = pdf_file.fileno()
+    except (AttributeError, OSError):
+        fileno = None
+
+    with tempfile.TemporaryFile() if fileno is None else nullcontext(pdf_file) as backing:
+        if fileno is None:
+            shutil.copyfileobj(pdf_file, backing)
+            backing.flush()
+        backing.seek(0, 2)
+        if backing.tell() == 0:
+            yield BytesIO(b"")
+            return
+        with mmap.mmap(backing.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+def iter_pdf_pages(pdf_file, backend=None):
+    """
+    Yield (page_number, text) for each page of a PDF, one page at a time.
+    Page numbers start at 1.
+    """
+    for page in get_pdf_backend(backend).iter_pages(pdf_file):
+        yield page.number, page.text
+
+def extract_pages_from_pdf(pdf_file):
+    """
+    Extract the text of each page of a PDF file.
+    Returns a list with one string per page, in page order.
+    """
+    with pdf_buffer(pdf_file) as buffer:
+        return [page.text for page in extract_page_layouts(buffer)]
 
 def extract_text_from_pdf(pdf_file):
     """
     Extract text from a PDF file.
     """
-    text = ""
-    reader = PyPDF2.PdfReader(BytesIO(pdf_file.read()))
+    return "\n".join(extract_pages_from_pdf(pdf_file)).strip()
 
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
+def read_pdf_source(path, member=None):
+    """
+    Return the bytes of a PDF on disk, or of a member of a zip archive.
+    """
+    if member is None:
+        with open(path, "rb") as pdf_file:
+            return pdf_file.read()
+    with zipfile.ZipFile(path) as archive:
+        return archive.read(member)
 
-    return text.strip()
+def extract_layouts_from_source(source):
+    """
+    Extract the page layouts of a (path, member) PDF source.
+    Kept free of model imports so it can run in lightweight worker processes.
+    """
+    path, member = source
+    if member is None:
+        return extract_page_layouts(path)
+    return extract_page_layouts(BytesIO(read_pdf_source(path, member)))
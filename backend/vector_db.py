@@ -1,131 +1,409 @@
-
+import hashlib
+import logging
 import psycopg2
-from sqlalchemy import create_engine, text
 from config import Config
+from db import get_connection, pool_stats
+from schema import ensure_schema
 from utils.embeddings import generate_embeddings
 from psycopg2.extras import execute_values
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+
+def content_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-engine = create_engine(Config.PG_DB_URI)
+def _chunk_row(paper_id, chunk, chunk_embedding):
+    return (
+        paper_id,
+        chunk["chunk_index"],
+        chunk["content"],
+        chunk.get("content_hash") or content_sha256(chunk["content"]),
+        chunk["page_start"],
+        chunk["page_end"],
+        chunk["char_start"],
+        chunk["char_end"],
+        chunk.get("section"),
+        np.asarray(chunk_embedding, dtype=np.float32),
+    )
 
-def db_connection():
+def write_chunks(cur, paper_chunks):
     """
-    Establish and return a connection to the PostgreSQL database.
+    Bring the stored chunks of papers in line with new chunk lists, given as
+    {paper_id: (chunks, chunk_embeddings)}. Rows whose content and position are
+    unchanged are not rewritten, changed or new ones are upserted with
+    multi-row INSERTs, and rows past the new last chunk are deleted.
+    Returns the number of chunk rows written.
     """
-    try:
-        conn = psycopg2.connect(
-            dbname=Config.PG_DATABASE,
-            user=Config.PG_USER,
-            password=Config.PG_PASSWORD,
-            host=Config.PG_HOST,
-            port=Config.PG_PORT
+    if not paper_chunks:
+        return 0
+    cur.execute(
+        """
+        SELECT paper_id, chunk_index, content_hash, page_start, page_end, char_start, char_end, section
+        FROM public.chunks WHERE paper_id = ANY(%s)
+        """,
+        (list(paper_chunks),)
+    )
+    stored = {(row[0], row[1]): row[2:] for row in cur.fetchall()}
+
+    rows = []
+    for paper_id, (chunks, chunk_embeddings) in paper_chunks.items():
+        for chunk, chunk_embedding in zip(chunks, chunk_embeddings):
+            row = _chunk_row(paper_id, chunk, chunk_embedding)
+            # content_hash and position columns, as selected above
+            if stored.get((paper_id, chunk["chunk_index"])) != row[3:9]:
+                rows.append(row)
+
+    if rows:
+        execute_values(
+            cur,
+            """
+            INSERT INTO public.chunks
+                (paper_id, chunk_index, content, content_hash, page_start, page_end, char_start, char_end, section, embedding)
+            VALUES %s
+            ON CONFLICT (paper_id, chunk_index) DO UPDATE SET
+                content = EXCLUDED.content,
+                content_hash = EXCLUDED.content_hash,
+                page_start = EXCLUDED.page_start,
+                page_end = EXCLUDED.page_end,
+                char_start = EXCLUDED.char_start,
+                char_end = EXCLUDED.char_end,
+                section = EXCLUDED.section,
+                embedding = EXCLUDED.embedding
+            """,
+            rows,
+            page_size=1000
         )
-        print(f"[DEBUG] Connected to database: {Config.PG_DATABASE} on {Config.PG_HOST}:{Config.PG_PORT}")
-        cur = conn.cursor()
-        cur.execute("SELECT current_database(), current_schema()")
-        db, schema = cur.fetchone()
-        print(f"[DEBUG] Current database: {db}, Current schema: {schema}")
-        cur.close()
-        return conn
-    except psycopg2.Error as e:
-        print(f"[ERROR] Database connection error: {e}")
-        return None
 
-def store_to_pgvector(title, content, embedding, file_binary):
+    cur.execute(
+        """
+        DELETE FROM public.chunks c
+        USING unnest(%s::bigint[], %s::integer[]) AS n(paper_id, chunk_count)
+        WHERE c.paper_id = n.paper_id AND c.chunk_index >= n.chunk_count
+        """,
+        (list(paper_chunks), [len(chunks) for chunks, _ in paper_chunks.values()])
+    )
+    return len(rows)
+
+def store_pdf_blob(cur, file_binary, sha256=None):
     """
-    Store the extracted content, embeddings, and PDF into the PostgreSQL pgvector table.
+    Store a PDF in pdf_blobs, deduplicated by SHA-256, and return its hash.
+    The bytes are only sent when the blob is not stored yet.
     """
-    conn = db_connection()
+    sha256 = sha256 or hashlib.sha256(file_binary).hexdigest()
+    # The lock keeps delete_orphan_blobs in another transaction off this blob until commit
+    cur.execute("SELECT 1 FROM public.pdf_blobs WHERE sha256 = %s FOR KEY SHARE", (sha256,))
+    if cur.fetchone() is None:
+        cur.execute(
+            """
+            INSERT INTO public.pdf_blobs (sha256, size, data) VALUES (%s, %s, %s)
+            ON CONFLICT (sha256) DO NOTHING
+            """,
+            (sha256, len(file_binary), psycopg2.Binary(file_binary))
+        )
+    return sha256
 
-    if not conn:
-        raise Exception("Failed to connect to database")
-    try:
-        cur = conn.cursor()
+def delete_orphan_blobs(cur, hashes):
+    """
+    Delete the PDFs among hashes that no paper references anymore, skipping
+    blobs that a concurrent upload has just claimed. Returns the number deleted.
+    """
+    if not hashes:
+        return 0
+    cur.execute(
+        """
+        DELETE FROM public.pdf_blobs WHERE sha256 IN (
+            SELECT b.sha256 FROM public.pdf_blobs b
+            WHERE b.sha256 = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM public.data d WHERE d.file_sha256 = b.sha256)
+            FOR UPDATE SKIP LOCKED
+        )
+        """,
+        (list(hashes),)
+    )
+    return cur.rowcount
 
-        # Ensure embedding is stored as a vector (list format for pgvector)
-        embedding_str = f"[{','.join(map(str, embedding))}]"
+def get_paper_versions(titles):
+    """
+    Return {title: {"paper_id", "file_sha256", "content_hash", "chunks"}} for the
+    stored papers among titles, so unchanged uploads can be skipped before parsing.
+    """
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
+        cur.execute(
+            """
+            SELECT d.title, d.id, d.file_sha256, d.content_hash,
+                   (SELECT count(*) FROM public.chunks c WHERE c.paper_id = d.id)
+            FROM public.data d
+            WHERE d.title = ANY(%s)
+            """,
+            (list(titles),)
+        )
+        return {
+            row[0]: {"paper_id": row[1], "file_sha256": row[2], "content_hash": row[3], "chunks": row[4]}
+            for row in cur.fetchall()
+        }
 
+def get_chunk_embeddings(titles, content_hashes):
+    """
+    Return {content_hash: embedding} for stored chunks of the given papers whose
+    content hash is among content_hashes, so re-ingestion only embeds new text.
+    Embeddings are float32 numpy arrays.
+    """
+    if not content_hashes:
+        return {}
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
         cur.execute(
-            "INSERT INTO public.data (title, content, embedding, fileStorage) VALUES (%s, %s, %s, %s)",
-            (title, content, embedding_str, psycopg2.Binary(file_binary))
+            """
+            SELECT DISTINCT ON (c.content_hash) c.content_hash, c.embedding
+            FROM public.chunks c
+            JOIN public.data d ON d.id = c.paper_id
+            WHERE d.title = ANY(%s) AND c.content_hash = ANY(%s)
+            """,
+            (list(titles), list(content_hashes))
         )
+        return {row[0]: row[1].to_numpy() for row in cur.fetchall()}
+
+def store_to_pgvector(title, content, embedding, file_binary, chunks=None, chunk_embeddings=None, file_sha256=None):
+    """
+    Store the extracted content and embeddings into the PostgreSQL pgvector table,
+    and the PDF itself into the pdf_blobs table.
+    A paper with the same title is updated in place, and when chunks are given
+    its chunk rows are brought up to date in the same transaction.
+    Returns the id of the paper row.
+    """
+    return store_papers_bulk([{
+        "title": title,
+        "content": content,
+        "embedding": embedding,
+        "file_binary": file_binary,
+        "file_sha256": file_sha256,
+        "chunks": chunks or [],
+        "chunk_embeddings": chunk_embeddings if chunk_embeddings is not None else [],
+    }])[0]
+
+def store_papers_bulk(papers):
+    """
+    Upsert many papers (by title) and their chunks in one transaction with
+    multi-row INSERTs. Each paper is a dict with title, content, embedding,
+    file_binary, chunks and chunk_embeddings, and optionally the file's
+    file_sha256. PDFs that a re-upload replaced, and that no other paper
+    shares, are deleted. Returns the paper ids in input order.
+    """
+    if not papers:
+        return []
+    # A title can only be upserted once per statement; the last copy wins
+    latest = {paper["title"]: paper for paper in papers}
+    try:
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            titles = list(latest)
+            content_hashes = [content_sha256(paper["content"]) for paper in latest.values()]
+
+            # Results cached for content that is being replaced are no longer valid
+            cur.execute(
+                """
+                DELETE FROM public.llm_cache
+                WHERE content_hash IN (
+                    SELECT d.content_hash
+                    FROM public.data d
+                    JOIN unnest(%s::text[], %s::text[]) AS new(title, content_hash) ON new.title = d.title
+                    WHERE d.content_hash IS DISTINCT FROM new.content_hash
+                )
+                """,
+                (titles, content_hashes)
+            )
+
+            cur.execute(
+                "SELECT file_sha256 FROM public.data WHERE title = ANY(%s) AND file_sha256 IS NOT NULL",
+                (titles,)
+            )
+            previous_hashes = {row[0] for row in cur.fetchall()}
+
+            file_hashes = [
+                store_pdf_blob(cur, paper["file_binary"], paper.get("file_sha256")) for paper in latest.values()
+            ]
 
-        conn.commit()
+            # numpy arrays are adapted to pgvector by the pooled connection
+            returned = execute_values(
+                cur,
+                """
+                INSERT INTO public.data (title, content, content_hash, embedding, file_sha256)
+                VALUES %s
+                ON CONFLICT (title) DO UPDATE SET
+                    content = EXCLUDED.content,
+                    content_hash = EXCLUDED.content_hash,
+                    embedding = EXCLUDED.embedding,
+                    file_sha256 = EXCLUDED.file_sha256,
+                    filestorage = NULL
+                RETURNING title, id
+                """,
+                [
+                    (title, paper["content"], content_hash, np.asarray(paper["embedding"], dtype=np.float32), file_sha256)
+                    for (title, paper), content_hash, file_sha256 in zip(latest.items(), content_hashes, file_hashes)
+                ],
+                page_size=100,
+                fetch=True
+            )
+            paper_ids = dict(returned)
+            # PDFs replaced by a re-upload
+            delete_orphan_blobs(cur, previous_hashes - set(file_hashes))
+
+            written = write_chunks(cur, {
+                paper_ids[title]: (paper["chunks"], paper["chunk_embeddings"])
+                for title, paper in latest.items() if paper["chunks"]
+            })
+            logger.info("Upserted %s papers, wrote %s changed chunks", len(latest), written)
+
+            conn.commit()
+            return [paper_ids[paper["title"]] for paper in papers]
     except Exception as e:
-        print(f"[ERROR] Database error: {e}")
-        raise  # Re-raise the exception
-    finally:
-        if conn:
-            cur.close()
-            conn.close()
-            
+        logger.error("Database error: %s", e)
+        raise
+
+def store_chunks(paper_id, chunks, chunk_embeddings):
+    """
+    Store the chunks of an already stored paper.
+    """
+    try:
+        with get_connection() as conn, conn.cursor() as cur:
+            ensure_schema(conn)
+            write_chunks(cur, {paper_id: (chunks, chunk_embeddings)})
+            conn.commit()
+    except Exception as e:
+        logger.error("Database error: %s", e)
+        raise
+
+def get_papers_without_chunks():
+    """Return (id, title, content) for every paper that has no rows in the chunks table."""
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
+        cur.execute(
+            """
+            SELECT d.id, d.title, d.content
+            FROM public.data d
+            WHERE NOT EXISTS (SELECT 1 FROM public.chunks c WHERE c.paper_id = d.id)
+            """
+        )
+        return cur.fetchall()
+
 def get_content_and_title(title):
     """Retrieve content and title by title from the database."""
-    query = "SELECT content, title FROM data WHERE title = :title"
+    query = "SELECT content, title FROM data WHERE title = %s"
     try:
-        with engine.connect() as conn:
-            print(f"[DEBUG] Executing query: {query} with title={title}")
-            result = conn.execute(text(query), {"title": title}).fetchone()
+        with get_connection() as conn, conn.cursor() as cur:
+            logger.debug("Executing query: %s with title=%s", query, title)
+            cur.execute(query, (title,))
+            result = cur.fetchone()
             if result:
-                print(f"[DEBUG] Found result with content length: {len(result[0])}")
+                logger.debug("Found result with content length: %s", len(result[0]))
                 return {"content": result[0], "title": result[1]}
             else:
-                print(f"[DEBUG] No content found for title: {title}")
+                logger.debug("No content found for title: %s", title)
                 return None
     except Exception as e:
-        print(f"[DEBUG] Error in get_content_and_title: {str(e)}")
+        logger.error("Error in get_content_and_title: %s", e)
         raise
 
+def get_content_hash(title):
+    """
+    Return the SHA-256 of a paper's content without transferring the content.
+    Papers stored before content_hash existed are hashed by the database.
+    """
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
+        cur.execute(
+            """
+            SELECT COALESCE(content_hash, encode(sha256(convert_to(content, 'UTF8')), 'hex'))
+            FROM public.data WHERE title = %s
+            """,
+            (title,)
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+
 def get_pdf_and_title(title):
-    """Retrieve the PDF file (filestorage) and title by title from the database."""
-    query = "SELECT filestorage, title FROM data WHERE title = :title"
-    with engine.connect() as conn:
-        result = conn.execute(text(query), {"title": title}).fetchone()
-        return {"filestorage": result[0], "title": result[1]} if result else None
+    """
+    Retrieve the PDF location, size and title by title from the database.
+    The PDF bytes themselves are read with iter_pdf_chunks. Papers not yet
+    moved to pdf_blobs are read from the legacy data.filestorage column.
+    """
+    query = """
+        SELECT d.id, d.title, d.file_sha256, COALESCE(b.size, octet_length(d.filestorage))
+        FROM data d
+        LEFT JOIN pdf_blobs b ON b.sha256 = d.file_sha256
+        WHERE d.title = %s
+    """
+    with get_connection() as conn, conn.cursor() as cur:
+        ensure_schema(conn)
+        cur.execute(query, (title,))
+        result = cur.fetchone()
+        if not result or result[3] is None:
+            return None
+        return {"paper_id": result[0], "title": result[1], "sha256": result[2], "size": result[3]}
+
+def iter_pdf_chunks(pdf, chunk_size=Config.PDF_STREAM_CHUNK_BYTES):
+    """
+    Yield the bytes of a PDF described by get_pdf_and_title in chunk_size pieces,
+    each read with its own short query so no connection is held between chunks.
+    """
+    if pdf["sha256"]:
+        query, key = "SELECT substring(data FROM %s FOR %s) FROM public.pdf_blobs WHERE sha256 = %s", pdf["sha256"]
+    else:
+        query, key = "SELECT substring(filestorage FROM %s FOR %s) FROM public.data WHERE id = %s", pdf["paper_id"]
+
+    for offset in range(0, pdf["size"], chunk_size):
+        with get_connection() as conn, conn.cursor() as cur:
+            # substring() offsets are 1-based
+            cur.execute(query, (offset + 1, chunk_size, key))
+            row = cur.fetchone()
+        if row is None:
+            return
+        yield bytes(row[0])
+
+def fetch_titles():
+    """Return the titles of all stored papers."""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT title FROM public.data")
+        return [row[0] for row in cur.fetchall()]
 
 
 def debug_pgvector_table():
     """Debug function to check embeddings in the database."""
     try:
-        conn = db_connection()
-        if not conn:
-            print("[ERROR] Failed to connect to database")
-            return
-        cur = conn.cursor()
-        
-        # Check if vector extension is installed
-        cur.execute("SELECT extname FROM pg_extension WHERE extname = 'vector'")
-        vector_extension = cur.fetchone()
-        print(f"[DEBUG] Vector extension installed: {vector_extension is not None}")
-        
-        # Check table existence and schema
-        cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = 'data'")
-        columns = cur.fetchall()
-        if not columns:
-            print("[ERROR] Table 'data' does not exist")
-        else:
-            print("[DEBUG] Table 'data' columns:")
-            for col in columns:
-                print(f"  - {col[0]}: {col[1]}")
-        
-        # Check rows for 'samplePaper'
-        cur.execute("SELECT title, content, embedding IS NOT NULL AS has_embedding FROM data WHERE title = 'samplePaper'")
-        row = cur.fetchone()
-        if row:
-            print(f"[DEBUG] Found row for 'samplePaper':")
-            print(f"  - Title: {row[0]}")
-            print(f"  - Content length: {len(row[1])}")
-            print(f"  - Has embedding: {row[2]}")
-            cur.execute("SELECT embedding::text FROM data WHERE title = 'samplePaper'")
-            embedding_text = cur.fetchone()[0]
-            print(f"  - Embedding sample: {embedding_text[:50]}...")
-        else:
-            print("[DEBUG] No row found for 'samplePaper'")
-        
-        cur.close()
-        conn.close()
-    except Exception as e:
-        print(f"[ERROR] Debug pgvector error: {str(e)}")
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT current_database(), current_schema()")
+            db, schema = cur.fetchone()
+            logger.debug("Current database: %s, Current schema: %s", db, schema)
+
+            # Check if vector extension is installed
+            cur.execute("SELECT extname FROM pg_extension WHERE extname = 'vector'")
+            vector_extension = cur.fetchone()
+            logger.debug("Vector extension installed: %s", vector_extension is not None)
 
+            # Check table existence and schema
+            cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = 'data'")
+            columns = cur.fetchall()
+            if not columns:
+                logger.error("Table 'data' does not exist")
+            else:
+                logger.debug("Table 'data' columns: %s", ", ".join(f"{col[0]} ({col[1]})" for col in columns))
+
+            # Check rows for 'samplePaper'
+            cur.execute("SELECT title, content, embedding IS NOT NULL AS has_embedding FROM data WHERE title = 'samplePaper'")
+            row = cur.fetchone()
+            if row:
+                cur.execute("SELECT embedding::text FROM data WHERE title = 'samplePaper'")
+                embedding_text = cur.fetchone()[0]
+                logger.debug(
+                    "Found row for 'samplePaper': title=%s, content length=%s, has embedding=%s, embedding sample=%s...",
+                    row[0], len(row[1]), row[2], (embedding_text or "")[:50],
+                )
+            else:
+                logger.debug("No row found for 'samplePaper'")
 
+        logger.debug("Connection pool stats: %s", pool_stats())
+    except Exception as e:
+        logger.error("Debug pgvector error: %s", e)
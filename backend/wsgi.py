@@ -0,0 +1,17 @@
+"""
+Production WSGI entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py sets preload_app, so this module is imported once in the
+master. The embedding model loaded here is shared copy-on-write by every
+forked worker instead of being loaded once per worker.
+"""
+from config import Config
+from utils.embeddings import get_embedding_model
+from app import app
+
+# ONNX Runtime sessions own native thread pools that do not survive fork(), so
+# the (small) ONNX model is loaded in each worker on first use instead
+if Config.EMBEDDING_BACKEND != "onnx":
+    get_embedding_model()